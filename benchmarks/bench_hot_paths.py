@@ -0,0 +1,288 @@
+"""
+Micro-benchmarks for the data and evaluation hot paths.
+
+Runs fully offline on synthetic CVs and job descriptions. Every case is
+parametrized by dataset size and attribute count and timed with
+`timeit.Timer.autorange`. Timings are divided by the time of a fixed
+calibration workload measured right before each run on the same machine,
+so the tracked baselines in `baselines.json` are comparable across machines.
+
+Usage (from the repository root):
+    python benchmarks/bench_hot_paths.py                    # run and compare
+    python benchmarks/bench_hot_paths.py --save-baseline    # record new baselines
+    python benchmarks/bench_hot_paths.py --filter evaluator --sizes 100 400
+"""
+import os
+import sys
+import json
+import timeit
+import random
+import argparse
+import hashlib
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_PATH)
+
+from src.helpers import protected_groups_uk, protected_groups_en, detect_feminitive, fix_decision_parser
+from src.loader_and_injection import DataLoader, DataInjection
+from src.experiment_runner import process_output
+from src.evaluation import Evalator
+from src.similarity import SIMILARITY_BACKENDS
+from src.prompt import PROMPTS, compile_prompt
+from src.planner import prompt_frame
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_SIZES = [50, 200, 800]
+DEFAULT_ATTR_COUNTS = [2, 6, 19]
+
+WORDS_EN = ["python", "developer", "team", "project", "experience", "years", "backend", "django", "cloud",
+            "design", "testing", "clients", "product", "agile", "sql", "api", "frontend", "react"]
+SENTENCES_UK = ["Я працювала з командою над проєктом.", "Я розробляв бекенд на Python.",
+                "Я тестувала мобільні застосунки.", "Я керував невеликою командою.",
+                "Маю досвід роботи з базами даних.", "Вивчала нові технології."]
+
+
+class HashingEmbedding:
+    """Tiny local stand-in for SentenceTransformer: hashed bag-of-words vectors"""
+    def __init__(self, dim: int = 256) -> None:
+        self.dim = dim
+
+    def encode(self, texts: list[str], **kwargs) -> np.ndarray:
+        emb = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in str(text).lower().split():
+                emb[i, int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % self.dim] += 1.0
+        return emb
+
+
+class Message:
+    """Mimics a chat model response for `process_output`"""
+    def __init__(self, content: str) -> None:
+        self.content = content
+
+
+def synthetic_cv_en(rng: random.Random, n_words: int = 200) -> str:
+    return " ".join(rng.choice(WORDS_EN) for _ in range(n_words))
+
+
+def synthetic_cv_uk(rng: random.Random, n_sentences: int = 12) -> str:
+    return " ".join(rng.choice(SENTENCES_UK) for _ in range(n_sentences))
+
+
+def synthetic_inputs(size: int, seed: int = 42) -> tuple[pd.DataFrame, pd.DataFrame, dict]:
+    """
+    Build synthetic candidates, jobs and matchers
+
+    Args:
+        size (int):   number of candidates
+        seed (int):   random seed, default is 42
+
+    Returns:
+        tuple: candidates, jobs and matchers
+    """
+    rng = random.Random(seed)
+    jobs = pd.DataFrame({
+        "id": [f"job_{i}" for i in range(max(size // 2, DataLoader.JOBS_PER_CANDIDATE))],
+        "Position": [rng.choice(WORDS_EN) for _ in range(max(size // 2, DataLoader.JOBS_PER_CANDIDATE))],
+    })
+    jobs["Long Description"] = [synthetic_cv_en(rng, 120) for _ in range(len(jobs))]
+    cvs = [synthetic_cv_en(rng) for _ in range(size)]
+    candidates = pd.DataFrame({
+        "id": [f"cand_{i}" for i in range(size)],
+        "Position": [rng.choice(WORDS_EN) for _ in range(size)],
+        "CV": cvs,
+        "CV_male_marked": cvs,
+        "CV_female_marked": cvs,
+        "CV_lang": "en",
+    })
+    matchers = {cand_id: rng.sample(list(jobs["id"]), DataLoader.JOBS_PER_CANDIDATE + 1) for cand_id in candidates["id"]}
+    return candidates, jobs, matchers
+
+
+def synthetic_results(size: int, attr_count: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Build a synthetic experiment result for one protected group
+
+    Args:
+        size (int):         number of group ids
+        attr_count (int):   number of protected attributes
+        seed (int):         random seed, default is 42
+
+    Returns:
+        pd.DataFrame: results in the format of the published datasets
+    """
+    rng = random.Random(seed)
+    rows = []
+    for group_num in range(size):
+        for attr_num in range(attr_count):
+            rows.append({
+                "group_id": f"group_{group_num}",
+                "lang": "en",
+                "protected_group": "gender",
+                "protected_attr": f"attr_{attr_num}",
+                "decision": rng.choice(["hire", "reject"]),
+                "feedback": synthetic_cv_en(rng, 25),
+            })
+    return pd.DataFrame(rows)
+
+
+def synthetic_raw_outputs(size: int, broken_share: float = 0.2, seed: int = 42) -> list[Message]:
+    rng = random.Random(seed)
+    outputs = []
+    for _ in range(size):
+        body = json.dumps({"decision": rng.choice(["hire", "reject"]), "feedback": synthetic_cv_en(rng, 20)})
+        if rng.random() < broken_share:
+            # truncated answer without closing quote and brace
+            body = body[:-2]
+        outputs.append(Message("```json\n" + body + "\n```"))
+    return outputs
+
+
+def build_cases(sizes: list[int], attr_counts: list[int]) -> list[tuple[str, dict, callable]]:
+    """
+    Build benchmark cases
+
+    Args:
+        sizes (list[int]):         dataset sizes
+        attr_counts (list[int]):   attribute counts
+
+    Returns:
+        list: (name, params, function to time) tuples
+    """
+    cases = []
+    for size in sizes:
+        rng = random.Random(size)
+        cvs_en = pd.Series([synthetic_cv_en(rng) for _ in range(size)])
+        cvs_uk = pd.Series([synthetic_cv_uk(rng) for _ in range(size)])
+        cases.append(("protected_groups_en", {"size": size}, lambda cvs=cvs_en: cvs.apply(protected_groups_en)))
+        cases.append(("protected_groups_uk", {"size": size}, lambda cvs=cvs_uk: cvs.apply(protected_groups_uk)))
+        cases.append(("detect_feminitive", {"size": size}, lambda cvs=cvs_uk: cvs.apply(detect_feminitive)))
+
+        candidates, jobs, matchers = synthetic_inputs(size)
+        loader = DataLoader.__new__(DataLoader)
+        loader.random_state, loader.lang = 42, "en"
+        cases.append(("DataLoader._data_combining", {"size": size},
+                      lambda c=candidates, j=jobs, m=matchers: loader._data_combining(c, j, m)))
+
+        combined = loader._data_combining(candidates, jobs, matchers)
+        outputs = synthetic_raw_outputs(size)
+        cases.append(("process_output", {"size": size}, lambda o=outputs: process_output(o)))
+        parsed = process_output(outputs)
+        parsed_df = pd.DataFrame({
+            "decision": [val.get("decision") if isinstance(val, dict) else None for val in parsed],
+            "feedback": [val.get("feedback") if isinstance(val, dict) else None for val in parsed],
+            "raw_ai_decision": [output.content.replace("```json\n", "").replace("\n```", "") for output in outputs],
+        })
+        cases.append(("fix_decision_parser", {"size": size}, lambda df=parsed_df: fix_decision_parser(df.copy())))
+
+        for attr_count in attr_counts:
+            attrs = [f"attr_{i}" for i in range(attr_count)]
+            injection = DataInjection(lang="en")
+            cases.append(("DataInjection._corrupt_data", {"size": size, "attr_count": attr_count},
+                          lambda df=combined, a=attrs: injection._corrupt_data(df, "gender", a)))
+
+            frame = prompt_frame(injection._corrupt_data(combined, "gender", attrs), "gender", "стать", "en")
+            cases.append(("PromptTemplate.format", {"size": size, "attr_count": attr_count},
+                          lambda f=frame: [PROMPTS["baseline_prompt_en"].format(**record) for record in f.to_dict("records")]))
+            cases.append(("CompiledPrompt.render", {"size": size, "attr_count": attr_count},
+                          lambda f=frame: compile_prompt("baseline_prompt_en").render(f)))
+
+            # "tfidf" skips loading an embedding model, the local stand-in is used for the "embedding" backend
+            evaluator = Evalator(None, None, "benchmark", frames={"gender": synthetic_results(size, attr_count)}, similarity_backend="tfidf")
+            evaluator.emb_model = HashingEmbedding()
+            for backend in SIMILARITY_BACKENDS:
+                cases.append((f"Evalator.get_report[{backend}]", {"size": size, "attr_count": attr_count},
+                              lambda e=evaluator, b=backend: e.get_report(similarity_backend=b)))
+    return cases
+
+
+def calibration_workload() -> None:
+    """Fixed mix of pure Python, pandas and numpy work, the unit of the normalized timings"""
+    rng = random.Random(0)
+    counts = {}
+    for word in (rng.choice(WORDS_EN) for _ in range(20000)):
+        counts[word] = counts.get(word, 0) + 1
+    df = pd.DataFrame({"key": np.arange(20000) % 97, "value": np.arange(20000, dtype=float)})
+    df.groupby("key")["value"].agg(["mean", "max"])
+    matrix = np.random.default_rng(0).normal(size=(200, 200))
+    matrix @ matrix
+
+
+def time_case(func: callable, repeat: int) -> tuple[float, float]:
+    """
+    Time a function with `timeit.Timer.autorange` (every measurement lasts at least 0.2 s), each run right after
+    a run of the calibration workload, so slow drifts of the machine speed cancel out in the normalized timing
+
+    Args:
+        func (callable):   function to time
+        repeat (int):      number of runs
+
+    Returns:
+        tuple: best wall time per call in seconds, median wall time relative to the calibration workload
+    """
+    timer, calibration = timeit.Timer(func), timeit.Timer(calibration_workload)
+    timings, ratios = [], []
+    for _ in range(repeat):
+        number, total = calibration.autorange()
+        unit = total / number
+        number, total = timer.autorange()
+        timings.append(total / number)
+        ratios.append(timings[-1] / unit)
+    return min(timings), float(np.median(ratios))
+
+
+def case_key(name: str, params: dict) -> str:
+    return name + "[" + ",".join(f"{key}={value}" for key, value in sorted(params.items())) + "]"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks for the data and evaluation hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--attr-counts", type=int, nargs="+", default=DEFAULT_ATTR_COUNTS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter", type=str, default=None, help="run only cases containing this substring")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed relative slowdown vs baseline (in calibration units, machines differ in Python vs numpy speed)")
+    parser.add_argument("--save-baseline", action="store_true", help="store timings as the new baselines")
+    parser.add_argument("--baseline-path", type=str, default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baseline_path):
+        with open(args.baseline_path, "r") as f:
+            baselines = json.load(f)
+
+    results = {}
+    regressions = []
+    for name, params, func in build_cases(args.sizes, args.attr_counts):
+        if args.filter and args.filter.lower() not in name.lower():
+            continue
+        key = case_key(name, params)
+        seconds, units = time_case(func, args.repeat)
+        results[key] = round(units, 6)
+        line = f"{key:<60} {seconds:>10.4f}s {results[key]:>10.4f}u"
+        if key in baselines:
+            ratio = results[key] / baselines[key] if baselines[key] > 0 else 1.0
+            line += f"  baseline {baselines[key]:.4f}u  x{ratio:.2f}"
+            if ratio > 1 + args.tolerance:
+                regressions.append(key)
+                line += "  REGRESSION"
+        print(line)
+
+    if args.save_baseline:
+        baselines.update(results)
+        with open(args.baseline_path, "w") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=2)
+        print(f"Baselines saved to {args.baseline_path} (in calibration units)")
+        return 0
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.tolerance:.0%} tolerance: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""
+Merge shard results of `run_experiment` into the usual per-group files.
+
+Usage (from the repository root):
+    python scripts/merge_shards.py --folder-path data/baseline --lang en --num-shards 4
+    python scripts/merge_shards.py --folder-path data/baseline --lang en --num-shards 4 --data-path data/input_en.csv
+"""
+import os
+import sys
+import argparse
+import pandas as pd
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_PATH)
+
+from src.experiment_runner import merge_shards
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Merge shard results into per-group files")
+    parser.add_argument("--folder-path", type=str, required=True)
+    parser.add_argument("--lang", type=str, required=True)
+    parser.add_argument("--num-shards", type=int, required=True)
+    parser.add_argument("--data-path", type=str, default=None, help="csv with the data passed to the shards")
+    parser.add_argument("--name-sample-size", type=int, default=None, help="full names per gender, as passed to run_experiment")
+    parser.add_argument("--force-run", action="store_true")
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data_path) if args.data_path else None
+    print(merge_shards(args.folder_path, args.lang, args.num_shards, data=data, force_run=args.force_run, name_sample_size=args.name_sample_size))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+import os
+import glob
+import json
+import logging
+import pandas as pd
+from typing import Union
+from langchain import PromptTemplate
+
+from src.prompt import CompiledPrompt, compile_prompt
+from src.planner import prompt_frame
+from src.loader_and_injection import DataInjection
+from src.experiment_runner import GeneratedMessage, process_output, save_results
+from src.constants import PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK
+
+logger = logging.getLogger("batch_mode")
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
+
+file_handler = logging.FileHandler('logs.log')
+file_handler.setLevel(logging.DEBUG)
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+
+def custom_ids(corrupted_data: pd.DataFrame, group_en: str) -> pd.Series:
+    """
+    Stable request ids: `group_id/protected_attr/protected_group`
+
+    Args:
+        corrupted_data (pd.DataFrame):   injected data for one protected group
+        group_en (str):                  protected group
+
+    Returns:
+        pd.Series:  custom id per record
+    """
+    return corrupted_data['group_id'].astype(str) + "/" + corrupted_data['protected_attr'].astype(str) + "/" + group_en
+
+
+def write_batch_requests(folder_path: str,
+                         prompt: Union[str, PromptTemplate, CompiledPrompt],
+                         data: pd.DataFrame,
+                         lang: str,
+                         model: str,
+                         shard_size: int = 50000,
+                         body_params: dict = None,
+                         url: str = "/v1/chat/completions",
+                         name_sample_size: int = None) -> list[str]:
+    """
+    Render every record into provider batch request JSONL files (OpenAI batch format), nothing is sent
+
+    Args:
+        folder_path (str):                                path to store the requests, files go to `{folder_path}/{lang}/batch_requests`
+        prompt (str | PromptTemplate | CompiledPrompt):   key in `PROMPTS`, prompt template or compiled prompt
+        data (pd.DataFrame):                              data to process
+        lang (str):                                       language of the data
+        model (str):                                      model name for the provider
+        shard_size (int):                                 max requests per file, default is 50000
+        body_params (dict):                               extra request body parameters (e.g. {"temperature": 0, "seed": 42}), default is None
+        url (str):                                        provider endpoint, default is "/v1/chat/completions"
+        name_sample_size (int):                           full names per gender for the "name" group (see `DataInjection`),
+                                                          default is None (10 first names)
+
+    Returns:
+        list[str]:  paths to the request files
+    """
+    prompt = compile_prompt(prompt)
+    save_root_path = os.path.join(folder_path, lang, "batch_requests")
+    os.makedirs(save_root_path, exist_ok=True)
+    data_corruption = DataInjection(lang=lang, name_sample_size=name_sample_size)
+
+    paths, seen_ids, shard, shard_lines = [], set(), 0, 0
+    request_file = None
+    for group_en, group_uk in zip(PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK):
+        corrupted_data = data_corruption.process(data, group_en)
+        rendered = prompt.render(prompt_frame(corrupted_data, group_en, group_uk, lang))
+        for custom_id, text in zip(custom_ids(corrupted_data, group_en), rendered):
+            if custom_id in seen_ids:
+                raise ValueError(f"Duplicated custom_id: {custom_id}")
+            seen_ids.add(custom_id)
+            if request_file is None or shard_lines >= shard_size:
+                if request_file is not None:
+                    request_file.close()
+                    shard += 1
+                paths.append(os.path.join(save_root_path, f"requests-{shard:04d}.jsonl"))
+                request_file, shard_lines = open(paths[-1], "w"), 0
+            request_file.write(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": url,
+                "body": {"model": model, "messages": [{"role": "user", "content": text}], **(body_params or {})},
+            }, ensure_ascii=False) + "\n")
+            shard_lines += 1
+    if request_file is not None:
+        request_file.close()
+    logger.info(f"Wrote {len(seen_ids)} requests to {len(paths)} files in {save_root_path}")
+    return paths
+
+
+def read_batch_results(result_paths: Union[str, list[str]]) -> tuple[dict, dict]:
+    """
+    Read provider batch result JSONL files
+
+    Args:
+        result_paths (str | list[str]):   glob pattern or list of result files
+
+    Returns:
+        tuple: custom_id -> generated message for successful requests, custom_id -> error for failed ones
+    """
+    if isinstance(result_paths, str):
+        result_paths = sorted(glob.glob(result_paths))
+    messages, errors = {}, {}
+    for path in result_paths:
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                try:
+                    if item.get("error") or response.get("status_code", 200) != 200:
+                        raise ValueError(item.get("error") or response.get("body"))
+                    messages[item["custom_id"]] = GeneratedMessage(response["body"]["choices"][0]["message"]["content"])
+                except Exception as e:
+                    errors[item["custom_id"]] = str(e)
+    return messages, errors
+
+
+def ingest_batch_results(folder_path: str, result_paths: Union[str, list[str]], data: pd.DataFrame, lang: str, force_run: bool = False,
+                         name_sample_size: int = None) -> dict:
+    """
+    Parse provider batch results with `process_output` and write the usual per-group result files
+
+    Args:
+        folder_path (str):                path to store the results (same layout as `run_experiment`)
+        result_paths (str | list[str]):   glob pattern or list of result files
+        data (pd.DataFrame):              data passed to `write_batch_requests`
+        lang (str):                       language of the data
+        force_run (bool):                 if True, overwrite existing results, default is False
+        name_sample_size (int):           same as for `write_batch_requests`, default is None
+
+    Returns:
+        dict:  "paths" (protected group -> path) and "missing" (protected group -> custom ids without a result)
+    """
+    save_root_path = os.path.join(folder_path, lang)
+    os.makedirs(save_root_path, exist_ok=True)
+    messages, errors = read_batch_results(result_paths)
+    logger.info(f"Read {len(messages)} results and {len(errors)} errors")
+    data_corruption = DataInjection(lang=lang, name_sample_size=name_sample_size)
+
+    data_paths, missing = {}, {}
+    for group_en in PROTECTED_GROUPS_LIST_EN:
+        path = os.path.join(save_root_path, f"{group_en}.csv")
+        if not force_run and os.path.exists(path):
+            logger.info(f"Skipping {group_en}, already exists")
+            continue
+        corrupted_data = data_corruption.process(data, group_en)
+        ids = custom_ids(corrupted_data, group_en).tolist()
+        missing[group_en] = [custom_id for custom_id in ids if custom_id not in messages]
+        generated_data = process_output([messages.get(custom_id, GeneratedMessage("")) for custom_id in ids])
+        save_results(corrupted_data, generated_data, path)
+        data_paths[group_en] = path
+        if missing[group_en]:
+            logger.info(f"{group_en}: {len(missing[group_en])} of {len(ids)} results are missing")
+    return {"paths": data_paths, "missing": missing}
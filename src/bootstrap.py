@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from src.helpers import hire_flags, majority_bias_flags
+
+
+def attribute_matrices(df: pd.DataFrame) -> tuple[list, np.ndarray, np.ndarray]:
+    """
+    Pivot results into group_id x protected_attr matrices of hire and bias flags
+
+    Args:
+        df (pd.DataFrame):   results with `group_id`, `protected_attr` and `decision` columns
+
+    Returns:
+        tuple: list of attributes, hire matrix and bias matrix (NaN where the record is missing)
+    """
+    group_codes, _ = pd.factorize(df["group_id"])
+    attr_codes, attrs = pd.factorize(df["protected_attr"])
+    hire = np.full((group_codes.max() + 1, len(attrs)), np.nan)
+    bias = np.full_like(hire, np.nan)
+    hire[group_codes, attr_codes] = hire_flags(df["decision"]).to_numpy()
+    bias[group_codes, attr_codes] = majority_bias_flags(df).to_numpy()
+    return list(attrs), hire, bias
+
+
+def _bootstrap_chunk(sums: np.ndarray, counts: np.ndarray, seed: np.random.SeedSequence, n_replicates: int) -> np.ndarray:
+    """
+    Compute cluster bootstrap replicates of per-attribute means
+
+    Args:
+        sums (np.ndarray):              group_id x statistic sums (NaN replaced by 0)
+        counts (np.ndarray):            group_id x statistic counts of present records
+        seed (np.random.SeedSequence):  seed of the chunk
+        n_replicates (int):             number of replicates
+
+    Returns:
+        np.ndarray:  n_replicates x statistic matrix of means
+    """
+    rng = np.random.default_rng(seed)
+    n_groups = sums.shape[0]
+    index = rng.integers(0, n_groups, size=(n_replicates, n_groups))
+    # weight of every group_id in every replicate = how many times it was drawn
+    offsets = np.arange(n_replicates)[:, None] * n_groups
+    weights = np.bincount((index + offsets).ravel(), minlength=n_replicates * n_groups).reshape(n_replicates, n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (weights @ sums) / (weights @ counts)
+
+
+def cluster_bootstrap(df: pd.DataFrame,
+                      n_bootstrap: int = 2000,
+                      ci: float = 0.95,
+                      seed: int = 42,
+                      n_jobs: int = 1,
+                      chunk_size: int = 250,
+                      gap_chunk_elements: int = 10_000_000) -> dict:
+    """
+    Cluster bootstrap over group_id of approval and bias rates per protected attribute
+
+    Args:
+        df (pd.DataFrame):   results of one protected group
+        n_bootstrap (int):   number of bootstrap replicates, default is 2000
+        ci (float):          confidence level, default is 0.95
+        seed (int):          random seed, default is 42
+        n_jobs (int):        number of processes, default is 1
+        chunk_size (int):    replicates computed at once, default is 250
+        gap_chunk_elements (int): max size of the replicate x attr x attr gap block computed at once
+                             (bounds memory for many attributes, e.g. sampled full names), default is 10_000_000
+
+    Returns:
+        dict: confidence intervals per attribute and two-sided p-values of approval gaps per attribute pair
+    """
+    attrs, hire, bias = attribute_matrices(df)
+    values = np.concatenate([hire, bias], axis=1)
+    present = ~np.isnan(values)
+    sums, counts = np.where(present, values, 0.0), present.astype(float)
+
+    chunks = [min(chunk_size, n_bootstrap - start) for start in range(0, n_bootstrap, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            replicates = list(executor.map(_bootstrap_chunk, [sums] * len(chunks), [counts] * len(chunks), seeds, chunks))
+    else:
+        replicates = [_bootstrap_chunk(sums, counts, chunk_seed, n) for chunk_seed, n in zip(seeds, chunks)]
+    replicates = np.concatenate(replicates, axis=0)
+
+    alpha = (1 - ci) / 2
+    lower, upper = np.nanquantile(replicates, [alpha, 1 - alpha], axis=0)
+    n_attrs = len(attrs)
+    hire_replicates = replicates[:, :n_attrs]
+
+    # gap replicates for every attribute pair (replicate x attr x attr), in blocks of attribute rows;
+    # comparisons with NaN are False, so missing gaps count only through n_valid
+    p_values = np.empty((n_attrs, n_attrs))
+    rows = max(1, gap_chunk_elements // max(hire_replicates.shape[0] * n_attrs, 1))
+    for start in range(0, n_attrs, rows):
+        gaps = hire_replicates[:, start:start + rows, None] - hire_replicates[:, None, :]
+        n_valid = np.maximum((~np.isnan(gaps)).sum(axis=0), 1)
+        share_le = (gaps <= 0).sum(axis=0) / n_valid
+        share_ge = (gaps >= 0).sum(axis=0) / n_valid
+        p_values[start:start + rows] = np.minimum(1.0, 2 * np.minimum(share_le, share_ge))
+
+    return {
+        "ci_reject_approve_per_attr": {attr: (round(float(lower[i]), 4), round(float(upper[i]), 4)) for i, attr in enumerate(attrs)},
+        "ci_bias_per_attr": {attr: (round(float(lower[n_attrs + i]), 4), round(float(upper[n_attrs + i]), 4)) for i, attr in enumerate(attrs)},
+        "gap_pvalues": {
+            f"{attrs[i]} | {attrs[j]}": round(float(p_values[i, j]), 4)
+            for i in range(n_attrs) for j in range(i + 1, n_attrs)
+        },
+    }
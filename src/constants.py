@@ -1,4 +1,9 @@
-MATCHER_PATH = "../data/groups.json"
+import os
+
+# data files are resolved relative to the repository root, so the modules work from any working directory
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MATCHER_PATH = os.path.join(ROOT_PATH, "data/groups.json")
 DATA_PATH = {
     "en": {
         "jobs": "Stereotypes-in-LLMs/recruitment-dataset-job-descriptions-english",
@@ -48,24 +53,29 @@ PROTECTED_GROUPS_LIST_EN = ['gender', 'marital_status', 'military_status', 'reli
 PROTECTED_GROUPS_LIST_UK = ['стать', 'сімейний статус', 'військовий стантус', 'релігія', 'ім\'я', 'вік']
 PROTECTED_GROUPS = {
     "gender": {
-        "uk": "../protected_groups/gender_ukr.txt",
-        "en": "../protected_groups/gender_en.txt"
+        "uk": os.path.join(ROOT_PATH, "protected_groups/gender_ukr.txt"),
+        "en": os.path.join(ROOT_PATH, "protected_groups/gender_en.txt")
     },
     "marital_status": {
-        "uk": "../protected_groups/marital_status_ukr.txt",
-        "en": "../protected_groups/marital_status_en.txt"
+        "uk": os.path.join(ROOT_PATH, "protected_groups/marital_status_ukr.txt"),
+        "en": os.path.join(ROOT_PATH, "protected_groups/marital_status_en.txt")
     },
     "military_status": {
-        "uk": "../protected_groups/military_status_ukr.txt",
-        "en": "../protected_groups/military_status_en.txt"
+        "uk": os.path.join(ROOT_PATH, "protected_groups/military_status_ukr.txt"),
+        "en": os.path.join(ROOT_PATH, "protected_groups/military_status_en.txt")
     },
     "religion": {
-        "uk": "../protected_groups/religion_ukr.txt",
-        "en": "../protected_groups/religion_en.txt"
+        "uk": os.path.join(ROOT_PATH, "protected_groups/religion_ukr.txt"),
+        "en": os.path.join(ROOT_PATH, "protected_groups/religion_en.txt")
     },
 }
 
 NAMES_PATH = {
-    "female": '../protected_groups/ukr_names/fem_fname.txt',
-    "male": '../protected_groups/ukr_names/masc_fname.txt'
-}
\ No newline at end of file
+    "female": os.path.join(ROOT_PATH, "protected_groups/ukr_names/fem_fname.txt"),
+    "male": os.path.join(ROOT_PATH, "protected_groups/ukr_names/masc_fname.txt")
+}
+
+LAST_NAMES_PATH = {
+    "female": os.path.join(ROOT_PATH, "protected_groups/ukr_names/fem_lname.txt"),
+    "male": os.path.join(ROOT_PATH, "protected_groups/ukr_names/masc_lname.txt")
+}
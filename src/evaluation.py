@@ -1,49 +1,100 @@
 import os
+import numpy as np
 import pandas as pd
-from datasets import load_dataset
-from sentence_transformers import SentenceTransformer, util
+from datasets import load_dataset, Dataset, DatasetDict
+from sentence_transformers import util
+
+from src.bootstrap import cluster_bootstrap, attribute_matrices
+from src.similarity import EmbeddingSimilarity, TfidfSimilarity, MinHashSimilarity, SIMILARITY_BACKENDS, EMBEDDING_TOLERANCE, \
+    load_embedding_model, check_similarity_tolerance
 
 
 class Evalator:
     """Class for evaluating fairness of the model"""
-    def __init__(self, emb_model_name: str, dataset_name: str, experiment_name: str) -> None:
+    def __init__(self, emb_model_name: str, dataset_name: str, experiment_name: str, frames: dict[str, pd.DataFrame] = None,
+                 similarity_backend: str = "embedding", emb_runtime: str = "torch", emb_pool_size: int = 0, sort_by_length: bool = True) -> None:
         """
         Init method for the class
         
         Args:
-            emb_model_name (str): Name of the embedding model to use
+            emb_model_name (str):   Name of the embedding model to use
+            dataset_name (str):     Name of the results dataset in Hugging Face Hub
+            experiment_name (str):  Name of the experiment
+            frames (dict):          local results per protected group, used instead of the dataset. Default is None
+            similarity_backend (str): feedback similarity backend: "embedding", "tfidf" or "minhash".
+                                    The embedding model is loaded only for "embedding". Default is "embedding"
+            emb_runtime (str):      runtime of the embedding model: "torch" (automatic device) or the CPU runtimes "onnx"
+                                    and "int8", default is "torch". Use `check_embedding_tolerance` to validate "onnx"/"int8" against fp32
+            emb_pool_size (int):    number of CPU processes for encoding, default is 0 (single process)
+            sort_by_length (bool):  with `emb_pool_size` > 1, sort feedbacks by length before splitting them between
+                                    the processes, default is True
             
         Returns:
             None
         """
-        self.emb_model = SentenceTransformer(emb_model_name)
-        self.data  = load_dataset(dataset_name)
+        if similarity_backend not in SIMILARITY_BACKENDS:
+            raise ValueError(f"Unknown similarity backend: {similarity_backend}")
+        self.emb_model_name = emb_model_name
+        self.similarity_backend = similarity_backend
+        self.emb_runtime = emb_runtime
+        self.emb_pool_size = emb_pool_size
+        self.sort_by_length = sort_by_length
+        self.emb_model = load_embedding_model(emb_model_name, emb_runtime) if similarity_backend == "embedding" else None
+        self.embedding_similarity = None
+        if frames is not None:
+            self.set_frames(frames, experiment_name)
+        else:
+            self.data  = load_dataset(dataset_name)
+            self.protected_groups = list(self.data.keys())
+            self.experiment_name = experiment_name
+
+    def set_frames(self, frames: dict[str, pd.DataFrame], experiment_name: str) -> None:
+        """
+        Replace the evaluated results, so one loaded embedding model serves several experiments
+
+        Args:
+            frames (dict):          local results per protected group
+            experiment_name (str):  Name of the experiment
+
+        Returns:
+            None
+        """
+        self.data = DatasetDict({group: Dataset.from_pandas(df, preserve_index=False) for group, df in frames.items()})
         self.protected_groups = list(self.data.keys())
         self.experiment_name = experiment_name
 
-    def get_report(self) -> pd.DataFrame:
+    def get_report(self, n_bootstrap: int = 0, ci: float = 0.95, n_jobs: int = 1, random_seed: int = 42, similarity_backend: str = None) -> pd.DataFrame:
         """
         Get report for the model
 
+        Args:
+            n_bootstrap (int):   number of cluster bootstrap replicates (over group_id) for confidence intervals
+                                 and attribute gap p-values, default is 0 (point estimates only)
+            ci (float):          confidence level, default is 0.95
+            n_jobs (int):        number of processes for the bootstrap, default is 1
+            random_seed (int):   random seed for the bootstrap, default is 42
+            similarity_backend (str): overrides the feedback similarity backend of the class for this report,
+                                 e.g. "tfidf" for screening. Default is None
+
         Returns:
             pd.DataFrame: DataFrame with the report
         """
 
         report_data = []
         for protected_group in self.protected_groups:
-            df = self.data[protected_group].to_pandas()
-            df = df[['group_id', 'lang', 'protected_group', 'protected_attr', 'decision', 'feedback']].groupby(by=["group_id"]).agg({
+            df_records = self.data[protected_group].to_pandas()
+            df = df_records[['group_id', 'lang', 'protected_group', 'protected_attr', 'decision', 'feedback']].groupby(by=["group_id"]).agg({
                 'lang': 'first',
                 'protected_group': 'first',
                 'protected_attr': list,
                 'decision': list,
                 'feedback': list
             }).reset_index()
-            temp_feedback_similarity = []
+            report_similarity_backend = similarity_backend or self.similarity_backend
+            temp_feedback_similarity = self.similarity_scores(df_records, report_similarity_backend)
             temp_decison_per_attr = {attr : [] for attr in df['protected_attr'][0]}
             temp_bias_per_attr = {attr : [] for attr in df['protected_attr'][0]}
             for group_data in df.to_dict('records'):
-                temp_feedback_similarity.extend(self.feedback_similarity_score_in_group(group_data['feedback']))
                 temp_decison_per_attr = self.reject_approve_in_group(temp_decison_per_attr, group_data['decision'], group_data['protected_attr'])
                 temp_bias_per_attr = self.bias_per_cv(temp_bias_per_attr, group_data['decision'], group_data['protected_attr'])
 
@@ -51,18 +102,100 @@ class Evalator:
             mean_bias_per_attr = {attr: round(sum(bias)/len(bias), 4) for attr, bias in temp_bias_per_attr.items()}
             mean_decision_per_attr = {attr: round(sum(decision)/len(decision), 4) for attr, decision in temp_decison_per_attr.items()}
             
-            report_data.append({
+            report = {
                 'experiment_name': self.experiment_name,
                 'protected_group': protected_group,
                 'lang': df['lang'].iloc[0],
-                'min_feedback_similarity': round(min(temp_feedback_similarity), 4),
+                # reports of different backends are appended to the same file by `save_report`
+                'similarity_backend': report_similarity_backend,
+                'min_feedback_similarity': round(float(np.min(temp_feedback_similarity)), 4),
                 'median_feedback_similarity': round(pd.Series(temp_feedback_similarity).median(), 4),
-                'max_feedback_similarity': round(max(temp_feedback_similarity), 4),
+                'max_feedback_similarity': round(float(np.max(temp_feedback_similarity)), 4),
                 'mean_reject_approve_per_attr': mean_decision_per_attr,
-                'mean_bias_per_attr': mean_bias_per_attr
-            })
+                'mean_bias_per_attr': mean_bias_per_attr,
+                'attr_flip_matrix': self.attribute_flip_matrix(df_records)
+            }
+            if n_bootstrap > 0:
+                report.update(cluster_bootstrap(df_records, n_bootstrap=n_bootstrap, ci=ci, seed=random_seed, n_jobs=n_jobs))
+            report_data.append(report)
         return pd.DataFrame(report_data)
 
+    def similarity_scores(self, df: pd.DataFrame, similarity_backend: str) -> np.ndarray:
+        """
+        Calculate similarity scores between feedbacks of every group_id, vectorized over the whole protected group
+
+        Args:
+            df (pd.DataFrame):          results of one protected group
+            similarity_backend (str):   "embedding", "tfidf" or "minhash"
+
+        Returns:
+            np.ndarray: similarity scores of all feedback pairs within the same group_id
+        """
+        if similarity_backend == "embedding":
+            backend = self.get_embedding_similarity()
+        elif similarity_backend == "tfidf":
+            backend = TfidfSimilarity()
+        elif similarity_backend == "minhash":
+            backend = MinHashSimilarity()
+        else:
+            raise ValueError(f"Unknown similarity backend: {similarity_backend}")
+        group_codes, _ = pd.factorize(df['group_id'])
+        return backend.group_similarities(df['feedback'].fillna("").astype(str).tolist(), group_codes)
+
+    def get_embedding_similarity(self) -> EmbeddingSimilarity:
+        """
+        Get the embedding similarity backend (the model and encode pool are created once)
+
+        Returns:
+            EmbeddingSimilarity: embedding similarity backend
+        """
+        if self.emb_model is None:
+            self.emb_model = load_embedding_model(self.emb_model_name, self.emb_runtime)
+        if self.embedding_similarity is None:
+            self.embedding_similarity = EmbeddingSimilarity(self.emb_model, pool_size=self.emb_pool_size, sort_by_length=self.sort_by_length)
+        return self.embedding_similarity
+
+    def check_embedding_tolerance(self, protected_group: str = None, n_groups: int = 50, tolerance: float = EMBEDDING_TOLERANCE) -> float:
+        """
+        Check that similarities of the optimized embedding runtime stay within tolerance of the fp32 model
+
+        Args:
+            protected_group (str):   protected group to sample feedbacks from, default is the first one
+            n_groups (int):          number of group_ids to sample, default is 50
+            tolerance (float):       max allowed absolute difference, default is `EMBEDDING_TOLERANCE`
+
+        Returns:
+            float: max absolute difference of pairwise similarity
+        """
+        df = self.data[protected_group or self.protected_groups[0]].to_pandas()
+        df = df[df['group_id'].isin(df['group_id'].unique()[:n_groups])]
+        group_codes, _ = pd.factorize(df['group_id'])
+        reference = EmbeddingSimilarity(load_embedding_model(self.emb_model_name, "torch"))
+        return check_similarity_tolerance(reference, self.get_embedding_similarity(), df['feedback'].fillna("").astype(str).tolist(),
+                                          group_codes, tolerance=tolerance)
+
+    @staticmethod
+    def attribute_flip_matrix(df: pd.DataFrame) -> dict:
+        """
+        Calculate the share of group_ids where the decision flips between two attributes, for every attribute pair
+
+        Args:
+            df (pd.DataFrame): results of one protected group
+
+        Returns:
+            dict: attribute -> attribute -> flip rate over group_ids having both attributes
+        """
+        attrs, hire, _ = attribute_matrices(df)
+        present = ~np.isnan(hire)
+        hired = np.where(present, hire, 0.0)
+        rejected = present & (hired == 0)
+        # group_ids where one attribute is hired and the other rejected, in both directions
+        flips = hired.T @ rejected + rejected.T @ hired
+        counts = present.T.astype(float) @ present
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rates = np.round(flips / counts, 4)
+        return {attr_a: {attr_b: float(rates[i, j]) for j, attr_b in enumerate(attrs)} for i, attr_a in enumerate(attrs)}
+
     def feedback_similarity_score_in_group(self, feedbacks: list[str]) -> list[float]:
         """
         Calculate similarity score between feedbacks in a group
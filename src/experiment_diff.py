@@ -0,0 +1,140 @@
+import os
+import glob
+import logging
+import pandas as pd
+from typing import Union
+
+from src.helpers import normalize_decision, hire_flags, majority_bias_flags
+
+logger = logging.getLogger("experiment_diff")
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
+
+file_handler = logging.FileHandler('logs.log')
+file_handler.setLevel(logging.DEBUG)
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+KEY_COLUMNS = ['group_id', 'protected_group', 'protected_attr']
+
+
+def read_run(run: Union[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Read only the columns needed for comparison from a result set
+
+    Args:
+        run (str | pd.DataFrame):   results, path to a result csv/parquet, or folder with per-group csv files
+                                    (e.g. `../data/baseline/en`)
+
+    Returns:
+        pd.DataFrame:  keys, decision and job position
+    """
+    columns = KEY_COLUMNS + ['decision', 'Job Position']
+    if isinstance(run, pd.DataFrame):
+        return run[[column for column in columns if column in run.columns]].copy()
+    if os.path.isdir(run):
+        # per-group results only, not shards or verification batches
+        paths = [path for path in sorted(glob.glob(os.path.join(run, "*.csv"))) if os.path.basename(path).count(".") == 1]
+        return pd.concat([read_run(path) for path in paths]).reset_index(drop=True)
+    if run.endswith(".parquet"):
+        df = pd.read_parquet(run)
+        return df[[column for column in columns if column in df.columns]]
+    return pd.read_csv(run, usecols=lambda column: column in columns, dtype={'protected_attr': str})
+
+
+def load_run(run: Union[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Load a result set for comparison
+
+    Args:
+        run (str | pd.DataFrame):   results or path (see `read_run`)
+
+    Returns:
+        pd.DataFrame:  categorical keys, normalized decision, hire and bias flags, job position
+    """
+    df = read_run(run)
+    df['protected_attr'] = df['protected_attr'].astype(str)
+    df['decision'] = df['decision'].map(normalize_decision).fillna("").astype(str).str.lower()
+    df['hire'] = hire_flags(df['decision']).astype('int8')
+    df['bias'] = majority_bias_flags(df).astype('int8')
+    for column in KEY_COLUMNS + ['decision'] + (['Job Position'] if 'Job Position' in df.columns else []):
+        df[column] = df[column].astype('category')
+    return df
+
+
+def compare_runs(runs: dict[str, Union[str, pd.DataFrame]], baseline: str = None, top_n: int = 20, output_path: str = None) -> dict[str, pd.DataFrame]:
+    """
+    Compare result sets against a baseline record by record
+
+    Args:
+        runs (dict):         run name -> results (see `load_run`)
+        baseline (str):      name of the baseline run, default is the first run
+        top_n (int):         number of most changed group_ids to list, default is 20
+        output_path (str):   if set, write the record-level diff to this Parquet file, default is None
+
+    Returns:
+        dict:  "per_attr" (flip rates, approval and bias changes per attribute), "per_position" (flip rates
+               per job position), "top_changed" (group_ids with most flips) and "diff" (record-level diff)
+    """
+    baseline = baseline or next(iter(runs))
+    loaded = {name: load_run(run) for name, run in runs.items()}
+    # shared categories make the key index levels of all runs identical
+    for column in KEY_COLUMNS:
+        categories = pd.Index(pd.concat([pd.Series(df[column].cat.categories) for df in loaded.values()]).unique())
+        for df in loaded.values():
+            df[column] = df[column].cat.set_categories(categories)
+    base = loaded[baseline].set_index(KEY_COLUMNS)
+    if not base.index.is_unique:
+        raise ValueError(f"Duplicated keys in {baseline}")
+
+    diffs = []
+    for name, df in loaded.items():
+        if name == baseline:
+            continue
+        other = df[KEY_COLUMNS + ['decision', 'hire', 'bias']].set_index(KEY_COLUMNS)
+        if not other.index.is_unique:
+            raise ValueError(f"Duplicated keys in {name}")
+        # hash join on the (group_id, protected_group, protected_attr) index
+        diff = base.join(other, how='inner', lsuffix='_base', rsuffix='_run').reset_index()
+        missing = len(base) - len(diff)
+        if missing:
+            logger.info(f"{name}: {missing} baseline records have no match")
+        diff['run'] = name
+        diff['flipped'] = diff['hire_base'] != diff['hire_run']
+        diffs.append(diff)
+    diff = pd.concat(diffs).reset_index(drop=True)
+    diff['run'] = diff['run'].astype('category')
+
+    per_attr = diff.groupby(['run', 'protected_group', 'protected_attr'], observed=True).agg(
+        records=('flipped', 'size'),
+        flip_rate=('flipped', 'mean'),
+        approve_base=('hire_base', 'mean'),
+        approve_run=('hire_run', 'mean'),
+        bias_base=('bias_base', 'mean'),
+        bias_run=('bias_run', 'mean'),
+    ).reset_index()
+    per_attr['approve_change'] = per_attr['approve_run'] - per_attr['approve_base']
+    per_attr['bias_change'] = per_attr['bias_run'] - per_attr['bias_base']
+
+    per_position = None
+    if 'Job Position' in diff.columns:
+        per_position = diff.groupby(['run', 'Job Position'], observed=True).agg(
+            records=('flipped', 'size'),
+            flip_rate=('flipped', 'mean'),
+        ).reset_index().sort_values(['run', 'flip_rate'], ascending=[True, False])
+
+    top_changed = diff.groupby(['run', 'protected_group', 'group_id'], observed=True).agg(
+        flips=('flipped', 'sum'),
+        records=('flipped', 'size'),
+    ).reset_index()
+    top_changed = top_changed[top_changed['flips'] > 0].sort_values(['run', 'flips'], ascending=[True, False]).groupby('run', observed=True).head(top_n)
+
+    diff = diff[['run'] + KEY_COLUMNS + ['decision_base', 'decision_run', 'flipped', 'bias_base', 'bias_run']]
+    if output_path is not None:
+        diff.to_parquet(output_path, index=False)
+    return {
+        "per_attr": per_attr.round(4),
+        "per_position": per_position.round(4) if per_position is not None else None,
+        "top_changed": top_changed.reset_index(drop=True),
+        "diff": diff,
+    }
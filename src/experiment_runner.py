@@ -1,11 +1,18 @@
 import os
 import time
 import json
+import hashlib
 import logging
+import numpy as np
 import pandas as pd
+from typing import Iterator, Union
+from langchain import PromptTemplate
 
-from loader_and_injection import DataInjection
-from src.prompt import PROMPTS
+from src.helpers import normalize_decision, majority_bias_flags
+from src.loader_and_injection import DataInjection
+from src.prompt import PROMPTS, CompiledPrompt, compile_prompt
+from src.planner import plan_experiment, prompt_frame
+from src.sequential import stopping_check
 from src.constants import PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK
 
 logger = logging.getLogger("experiment_runner")
@@ -17,7 +24,13 @@ file_handler.setLevel(logging.DEBUG)
 file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 
-def experiment_core(corrupted_data: pd.DataFrame, corrupted_data_records: list, group_en: str, chain: object, save_root_path: str, data_paths: dict, batch_size: int = 32) -> dict:
+# "file_order" sends every batch in one round. "group_id" sends the first variant of every group_id in a batch (leader)
+# one round before its other variants (followers), so the shared prompt prefix is already in the backend cache for the
+# followers; the followers of a batch share a round with the leaders of the next batch (see `dispatch_batches`)
+DISPATCH_POLICIES = ["file_order", "group_id"]
+
+def experiment_core(corrupted_data: pd.DataFrame, corrupted_data_records: list, group_en: str, chain: object, save_root_path: str, data_paths: dict, batch_size: int = 32, file_name: str = None, temp_path: str = "temp.jsonl",
+                    stream_results: bool = False, chunk_size: int = 1000, dispatch: str = "file_order", progress: bool = False) -> dict:
     """
     Core method for running the experiment
 
@@ -29,57 +42,460 @@ def experiment_core(corrupted_data: pd.DataFrame, corrupted_data_records: list,
         save_root_path (str):                path to save the results
         data_paths (dict):                   dictionary to store the paths
         batch_size (int):                    batch size for processing, default is 32
+        file_name (str):                     name of the result file, default is `{group_en}.csv`
+        temp_path (str):                     path to the temporary results, default is `temp.jsonl`
+        stream_results (bool):               if True, keep no results in memory: write them with their keys to
+                                             `{group}.results.jsonl` in chunks and build the result file by a streaming
+                                             join (see `stream_join_results`), default is False
+        chunk_size (int):                    rows per written chunk in `stream_results` mode, default is 1000
+        dispatch (str):                      request order within a batch, one of `DISPATCH_POLICIES`, default is "file_order"
+        progress (bool):                     if True, append keyed results of every batch to `{group}.progress.jsonl`
+                                             for live evaluation (see `StreamingEvalator.follow`), default is False
 
     Returns:
         dict:  dictionary with the paths
     """
+    if stream_results:
+        return experiment_core_streaming(corrupted_data, corrupted_data_records, group_en, chain, save_root_path, data_paths,
+                                         batch_size=batch_size, file_name=file_name, chunk_size=chunk_size, dispatch=dispatch, progress=progress)
+    file_name = file_name or f"{group_en}.csv"
+    progress_file = start_progress(save_root_path, file_name, progress)
+    cache_stats = {"requests": 0, "reported": 0, "input_tokens": 0, "cached_tokens": 0}
+    group_ids = corrupted_data['group_id'].tolist() if dispatch == "group_id" else None
     generated_data = []
-    while len(generated_data) < len(corrupted_data):
-        batch_data = corrupted_data_records[len(generated_data):len(generated_data)+batch_size]
-        get_result = False 
-        i = 0
-        while (not get_result) and (i < 10):
-            try:
-                results = chain.batch(batch_data, config={"max_concurrency": batch_size})
-                get_result = True
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                time.sleep(30)
-                i += 1
-
+    for results in dispatch_batches(chain, corrupted_data_records, batch_size, group_ids=group_ids, cache_stats=cache_stats):
+        batch_start = len(generated_data)
         generated_data.extend(process_output(results))
 
+        write_progress(progress_file, corrupted_data.iloc[batch_start:len(generated_data)], generated_data[batch_start:])
+
         # save temp data
-        with open(f"temp.jsonl", "w") as f:
+        with open(temp_path, "w") as f:
             for item in generated_data:
                 f.write(json.dumps(item) + "\n")
 
         if len(generated_data) % 500 == 0:
             logger.info(f"Generated {len(generated_data)} records")
 
+    logger.info(f"Saving {group_en}")
+    save_results(corrupted_data, generated_data, os.path.join(save_root_path, file_name))
+    save_cache_stats(cache_stats, save_root_path, file_name, dispatch)
+    data_paths[group_en] = os.path.join(save_root_path, file_name)
+    return data_paths
+
+def experiment_core_streaming(corrupted_data: pd.DataFrame, corrupted_data_records: list, group_en: str, chain: object, save_root_path: str, data_paths: dict,
+                              batch_size: int = 32, file_name: str = None, chunk_size: int = 1000, dispatch: str = "file_order", progress: bool = False) -> dict:
+    """
+    Constant-memory version of `experiment_core`: processed results are appended with their keys to
+    `{group}.results.jsonl` every `chunk_size` rows and joined with the corrupted data chunk by chunk at the end
+
+    Args:
+        corrupted_data (pd.DataFrame):       corrupted data
+        corrupted_data_records (list):       corrupted data records
+        group_en (str):                      protected group
+        chain (object):                      chain Langchain object
+        save_root_path (str):                path to save the results
+        data_paths (dict):                   dictionary to store the paths
+        batch_size (int):                    batch size for processing, default is 32
+        file_name (str):                     name of the result file, default is `{group_en}.csv`
+        chunk_size (int):                    rows per written chunk, default is 1000
+        dispatch (str):                      request order within a batch, one of `DISPATCH_POLICIES`, default is "file_order"
+        progress (bool):                     if True, also write `{group}.progress.jsonl` (see `experiment_core`), default is False
+
+    Returns:
+        dict:  dictionary with the paths
+    """
+    file_name = file_name or f"{group_en}.csv"
+    progress_file = start_progress(save_root_path, file_name, progress)
+    results_file = os.path.join(save_root_path, os.path.splitext(file_name)[0] + ".results.jsonl")
+    keys = corrupted_data[['group_id', 'protected_attr']]
+    cache_stats = {"requests": 0, "reported": 0, "input_tokens": 0, "cached_tokens": 0}
+    group_ids = corrupted_data['group_id'].tolist() if dispatch == "group_id" else None
+    pending, n_generated = [], 0
+    with open(results_file, "w") as f:
+        for raw_results in dispatch_batches(chain, corrupted_data_records, batch_size, group_ids=group_ids, cache_stats=cache_stats):
+            results = process_output(raw_results)
+            write_progress(progress_file, corrupted_data.iloc[n_generated:n_generated+len(results)], results)
+            for (group_id, attr), val in zip(keys.iloc[n_generated:n_generated+len(results)].itertuples(index=False), results):
+                pending.append(json.dumps({"group_id": group_id, "protected_attr": attr, "raw_ai_decision": val}, ensure_ascii=False, default=str))
+            n_generated += len(results)
+            if len(pending) >= chunk_size or n_generated >= len(corrupted_data):
+                f.write("\n".join(pending) + "\n")
+                f.flush()
+                pending = []
+            if n_generated % 500 == 0:
+                logger.info(f"Generated {n_generated} records")
+
+    logger.info(f"Saving {group_en}")
+    stream_join_results(corrupted_data, results_file, os.path.join(save_root_path, file_name), chunk_size=chunk_size)
+    os.remove(results_file)
+    save_cache_stats(cache_stats, save_root_path, file_name, dispatch)
+    data_paths[group_en] = os.path.join(save_root_path, file_name)
+    return data_paths
+
+def stream_join_results(corrupted_data: pd.DataFrame, results_file: str, path: str, chunk_size: int = 1000) -> None:
+    """
+    Join the corrupted data with streamed results chunk by chunk and append each chunk to the result csv
+    (same content as `save_results`)
+
+    Args:
+        corrupted_data (pd.DataFrame):   corrupted data
+        results_file (str):              results jsonl in the order of the corrupted data
+        path (str):                      path to the result csv
+        chunk_size (int):                rows per chunk, default is 1000
+
+    Returns:
+        None
+    """
+    with open(results_file, "r") as f:
+        for chunk_start in range(0, len(corrupted_data), chunk_size):
+            chunk = corrupted_data.iloc[chunk_start:chunk_start+chunk_size]
+            results = [json.loads(f.readline()) for _ in range(len(chunk))]
+            key_mismatch = [
+                (group_id, attr) for (group_id, attr), val in zip(chunk[['group_id', 'protected_attr']].itertuples(index=False), results)
+                if str(val['group_id']) != str(group_id) or str(val['protected_attr']) != str(attr)
+            ]
+            if key_mismatch:
+                raise ValueError(f"Results are out of order with the data, e.g. {key_mismatch[:3]}")
+            generated_data = [val['raw_ai_decision'] for val in results]
+            chunk = chunk.assign(
+                decision=[val['decision'] if (isinstance(val, dict)) and ("decision" in val.keys()) else "" for val in generated_data],
+                feedback=[val['feedback'] if (isinstance(val, dict)) and ("feedback" in val.keys()) else "" for val in generated_data],
+                raw_ai_decision=generated_data,
+            )
+            chunk.to_csv(path, index=False, mode="w" if chunk_start == 0 else "a", header=chunk_start == 0)
+
+def experiment_adaptive(corrupted_data: pd.DataFrame, corrupted_data_records: list, group_en: str, chain: object, save_root_path: str, data_paths: dict, batch_size: int = 32,
+                        file_name: str = None, temp_path: str = "temp.jsonl", wave_size: int = 50, stopping_rule: str = "ci_width", ci_width: float = 0.1, alpha: float = 0.05,
+                        margin: float = 0.05, min_waves: int = 2, random_seed: int = 42, dispatch: str = "file_order", progress: bool = False) -> dict:
+    """
+    Run the experiment in waves of group_ids (in random order) and stop the protected group early
+    once the estimates are stable (see `stopping_check`). The stopping rule and final estimates are
+    saved next to the results as `{group}.stopping.json`.
+
+    Args:
+        corrupted_data (pd.DataFrame):       corrupted data
+        corrupted_data_records (list):       corrupted data records
+        group_en (str):                      protected group
+        chain (object):                      chain Langchain object
+        save_root_path (str):                path to save the results
+        data_paths (dict):                   dictionary to store the paths
+        batch_size (int):                    batch size for processing, default is 32
+        file_name (str):                     name of the result file, default is `{group_en}.csv`
+        temp_path (str):                     path to the temporary results, default is `temp.jsonl`
+        wave_size (int):                     number of group_ids per wave, default is 50
+        stopping_rule (str):                 "ci_width" or "sequential", default is "ci_width"
+        ci_width (float):                    max CI width for "ci_width", default is 0.1
+        alpha (float):                       error rate, default is 0.05
+        margin (float):                      equivalence margin for "sequential", default is 0.05
+        min_waves (int):                     minimal number of waves before stopping, default is 2
+        random_seed (int):                   random seed for the group_id order, default is 42
+        dispatch (str):                      request order within a batch, one of `DISPATCH_POLICIES`, default is "file_order"
+        progress (bool):                     if True, also write `{group}.progress.jsonl` (see `experiment_core`), default is False
+
+    Returns:
+        dict:  dictionary with the paths
+    """
+    file_name = file_name or f"{group_en}.csv"
+    progress_file = start_progress(save_root_path, file_name, progress)
+
+    corrupted_data = corrupted_data.reset_index(drop=True)
+    group_order = np.random.default_rng(random_seed).permutation(corrupted_data['group_id'].unique())
+    n_waves = int(np.ceil(len(group_order) / wave_size))
+    row_waves = corrupted_data['group_id'].map({group_id: i // wave_size for i, group_id in enumerate(group_order)})
+
+    cache_stats = {"requests": 0, "reported": 0, "input_tokens": 0, "cached_tokens": 0}
+    processed_rows, generated_data, check = [], [], {"stop": False}
+    wave = 0
+    for wave in range(n_waves):
+        wave_rows = np.flatnonzero(row_waves.to_numpy() == wave)
+        group_ids = corrupted_data['group_id'].iloc[wave_rows].tolist() if dispatch == "group_id" else None
+        batch_start = 0
+        for raw_results in dispatch_batches(chain, [corrupted_data_records[i] for i in wave_rows], batch_size, group_ids=group_ids, cache_stats=cache_stats):
+            batch_rows = wave_rows[batch_start:batch_start+len(raw_results)]
+            results = process_output(raw_results)
+            write_progress(progress_file, corrupted_data.iloc[batch_rows], results)
+            generated_data.extend(results)
+            batch_start += len(raw_results)
+
+            # save temp data
+            with open(temp_path, "w") as f:
+                for item in generated_data:
+                    f.write(json.dumps(item) + "\n")
+        processed_rows.extend(wave_rows)
+
+        processed = corrupted_data.iloc[processed_rows][['group_id', 'protected_attr']].copy()
+        processed['decision'] = [normalize_decision(val['decision']) if (isinstance(val, dict)) and ("decision" in val.keys()) else "" for val in generated_data]
+        check = stopping_check(processed, stopping_rule=stopping_rule, ci_width=ci_width, alpha=alpha, margin=margin, n_looks=n_waves)
+        logger.info(f"{group_en} wave {wave + 1}/{n_waves}: {check['group_ids']} group_ids, stop={check['stop']}")
+        if check['stop'] and wave + 1 >= min_waves:
+            break
+
+    logger.info(f"Saving {group_en}")
+    save_results(corrupted_data.iloc[processed_rows].copy(), generated_data, os.path.join(save_root_path, file_name))
+    save_cache_stats(cache_stats, save_root_path, file_name, dispatch)
+    with open(os.path.join(save_root_path, os.path.splitext(file_name)[0] + ".stopping.json"), "w") as f:
+        json.dump({
+            "stopping_rule": stopping_rule,
+            "params": {"wave_size": wave_size, "ci_width": ci_width, "alpha": alpha, "margin": margin, "min_waves": min_waves, "random_seed": random_seed},
+            "stopped_early": wave + 1 < n_waves,
+            "waves": wave + 1,
+            "total_waves": n_waves,
+            "requests": len(processed_rows),
+            "total_requests": len(corrupted_data),
+            **check,
+        }, f, ensure_ascii=False, indent=2)
+    data_paths[group_en] = os.path.join(save_root_path, file_name)
+    return data_paths
+
+def dispatch_batches(chain: object, records: list, batch_size: int = 32, group_ids: list = None, cache_stats: dict = None) -> Iterator[list]:
+    """
+    Send records in batches and yield the raw results of every batch in order
+
+    Without group_ids every batch is one request round. With group_ids (the "group_id" dispatch policy, records of a group_id
+    should be adjacent, as `DataInjection` writes them) the first record of every group_id in a batch (leader) is sent one
+    round before the other records of the batch (followers), so the followers find the shared prompt prefix in the backend
+    cache. The followers of batch k are sent together with the leaders of batch k+1, so there is one extra round in total,
+    not one per batch.
+
+    Args:
+        chain (object):      chain Langchain object, or the bare model when `prompt` is set
+        records (list):      records to send
+        batch_size (int):    records per batch and max concurrency, default is 32
+        group_ids (list):    group_id per record, default is None
+        cache_stats (dict):  counters for `call_chain`, default is None
+
+    Returns:
+        Iterator[list]: raw results per batch
+    """
+    if group_ids is None:
+        for batch_start in range(0, len(records), batch_size):
+            yield call_chain(chain, records[batch_start:batch_start+batch_size], batch_size, cache_stats=cache_stats)
+        return
+
+    def split(batch_start: int) -> tuple[list, list]:
+        if batch_start >= len(records):
+            return [], []
+        is_leader = ~pd.Series(group_ids[batch_start:batch_start+batch_size]).duplicated().to_numpy()
+        return list(batch_start + np.flatnonzero(is_leader)), list(batch_start + np.flatnonzero(~is_leader))
+
+    leaders, followers = split(0)
+    leader_results = call_chain(chain, [records[i] for i in leaders], batch_size, cache_stats=cache_stats) if leaders else []
+    for batch_start in range(0, len(records), batch_size):
+        next_leaders, next_followers = split(batch_start + batch_size)
+        round_rows = followers + next_leaders
+        round_results = call_chain(chain, [records[i] for i in round_rows], batch_size, cache_stats=cache_stats) if round_rows else []
+        results = dict(zip(leaders, leader_results))
+        results.update(zip(followers, round_results[:len(followers)]))
+        yield [results[i] for i in range(batch_start, min(batch_start + batch_size, len(records)))]
+        leader_results = round_results[len(followers):]
+        leaders, followers = next_leaders, next_followers
+
+def call_chain(chain: object, batch_data: list, batch_size: int = 32, cache_stats: dict = None) -> list:
+    """
+    Call the chain for a batch, retrying up to 10 times on errors
+
+    Args:
+        chain (object):      chain Langchain object, or the bare model when `prompt` is set
+        batch_data (list):   records of the batch
+        batch_size (int):    max concurrency, default is 32
+        cache_stats (dict):  if set, token and prefix cache counters updated with the responses (see `prefix_cache_usage`),
+                             default is None
+
+    Returns:
+        list:  raw results
+    """
+    get_result = False 
+    i = 0
+    while (not get_result) and (i < 10):
+        try:
+            results = chain.batch(batch_data, config={"max_concurrency": batch_size})
+            get_result = True
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            time.sleep(30)
+            i += 1
+    if cache_stats is not None:
+        for result in results:
+            usage = prefix_cache_usage(result)
+            cache_stats["requests"] += 1
+            if usage is not None:
+                cache_stats["reported"] += 1
+                cache_stats["input_tokens"] += usage[0]
+                cache_stats["cached_tokens"] += usage[1]
+    return results
+
+def prefix_cache_usage(result: object) -> tuple:
+    """
+    Input and cached prompt tokens of a response, as reported by the backend
+
+    Args:
+        result (object):   raw result (chat model message)
+
+    Returns:
+        tuple:  (input tokens, cached input tokens), or None if the backend does not report cached tokens
+    """
+    # Langchain standard usage metadata
+    usage = getattr(result, "usage_metadata", None) or {}
+    input_details = usage.get("input_token_details") or {}
+    if usage.get("input_tokens") is not None and input_details.get("cache_read") is not None:
+        return int(usage["input_tokens"]), int(input_details["cache_read"])
+    # raw provider usage: OpenAI `prompt_tokens_details.cached_tokens`, Anthropic `cache_read_input_tokens`
+    metadata = getattr(result, "response_metadata", None) or {}
+    token_usage = metadata.get("token_usage") or metadata.get("usage") or {}
+    cached = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached is not None and token_usage.get("prompt_tokens") is not None:
+        return int(token_usage["prompt_tokens"]), int(cached)
+    if token_usage.get("cache_read_input_tokens") is not None and token_usage.get("input_tokens") is not None:
+        cached = int(token_usage["cache_read_input_tokens"])
+        return int(token_usage["input_tokens"]) + cached + int(token_usage.get("cache_creation_input_tokens") or 0), cached
+    return None
+
+def save_cache_stats(cache_stats: dict, save_root_path: str, file_name: str, dispatch: str) -> None:
+    """
+    Log the prefix cache hit rate and save it next to the results as `{group}.cache_stats.json`,
+    nothing is saved if the backend does not report cached tokens
+
+    Args:
+        cache_stats (dict):     counters from `call_chain`
+        save_root_path (str):   path to save the results
+        file_name (str):        name of the result file
+        dispatch (str):         dispatch policy of the run
+
+    Returns:
+        None
+    """
+    if not cache_stats["reported"]:
+        return
+    hit_rate = cache_stats["cached_tokens"] / max(cache_stats["input_tokens"], 1)
+    logger.info(f"{file_name}: prefix cache hit rate {hit_rate:.2%} over {cache_stats['reported']} of {cache_stats['requests']} responses ({dispatch})")
+    with open(os.path.join(save_root_path, os.path.splitext(file_name)[0] + ".cache_stats.json"), "w") as f:
+        json.dump({"dispatch": dispatch, **cache_stats, "hit_rate": round(hit_rate, 4)}, f, indent=2)
+
+def save_results(corrupted_data: pd.DataFrame, generated_data: list, path: str) -> None:
+    """
+    Add processed results as columns to the corrupted data and save it
+
+    Args:
+        corrupted_data (pd.DataFrame):   corrupted data
+        generated_data (list):           processed results in the same order
+        path (str):                      path to the result csv
+
+    Returns:
+        None
+    """
     generated_decision = [val['decision'] if (isinstance(val, dict)) and ("decision" in val.keys()) else "" for val in generated_data]
     generated_feedback = [val['feedback'] if (isinstance(val, dict)) and ("feedback" in val.keys()) else "" for val in generated_data]
 
     corrupted_data["decision"] = generated_decision
     corrupted_data["feedback"] = generated_feedback
     corrupted_data["raw_ai_decision"] = generated_data
-    logger.info(f"Saving {group_en}")
-    corrupted_data.to_csv(os.path.join(save_root_path, f"{group_en}.csv"), index=False)
-    data_paths[group_en] = os.path.join(save_root_path, f"{group_en}.csv")
-    return data_paths
+    corrupted_data.to_csv(path, index=False)
+
+def progress_path(save_root_path: str, file_name: str) -> str:
+    """
+    Path to the progress jsonl of a result file
+
+    Args:
+        save_root_path (str):   path to save the results
+        file_name (str):        name of the result file
+
+    Returns:
+        str:  path to the progress jsonl
+    """
+    return os.path.join(save_root_path, os.path.splitext(file_name)[0] + ".progress.jsonl")
 
-def run_experiment(folder_path: str,  chain: object, data: pd.DataFrame, lang: str, batch_size: int = 32, force_run: bool = False) -> dict:
+def start_progress(save_root_path: str, file_name: str, progress: bool) -> Union[str, None]:
+    """
+    Create an empty progress jsonl for a result file if progress is enabled
+
+    Args:
+        save_root_path (str):   path to save the results
+        file_name (str):        name of the result file
+        progress (bool):        if False, no progress file is written
+
+    Returns:
+        str | None:  path to the progress jsonl, None if progress is disabled
+    """
+    if not progress:
+        return None
+    path = progress_path(save_root_path, file_name)
+    open(path, "w").close()
+    return path
+
+def write_progress(path: Union[str, None], batch: pd.DataFrame, generated_results: list) -> None:
+    """
+    Append processed results with their keys to the progress jsonl
+
+    Args:
+        path (str | None):          path to the progress jsonl, nothing is written if None
+        batch (pd.DataFrame):       corrupted data of the batch
+        generated_results (list):   processed results of the batch
+
+    Returns:
+        None
+    """
+    if path is None:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        for record, val in zip(batch[['group_id', 'lang', 'protected_group', 'protected_attr']].to_dict('records'), generated_results):
+            record["decision"] = val['decision'] if (isinstance(val, dict)) and ("decision" in val.keys()) else ""
+            record["feedback"] = val['feedback'] if (isinstance(val, dict)) and ("feedback" in val.keys()) else ""
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+def run_experiment(folder_path: str,  chain: object, data: pd.DataFrame, lang: str, batch_size: int = 32, force_run: bool = False, dry_run: bool = False,
+                   shard_index: int = None, num_shards: int = None, adaptive: dict = None, stream_results: bool = False, name_sample_size: int = None,
+                   prompt: Union[str, PromptTemplate, CompiledPrompt] = None, dispatch: str = "file_order", plan_kwargs: dict = None,
+                   progress: bool = False) -> dict:
     """
     Run experiment for all protected groups
     
     Args:
         folder_path (str):   path to store the results
-        chain (object):      chain Langchain object
+        chain (object):      chain Langchain object, or the bare model when `prompt` is set
         data (pd.DataFrame): data to process
         lang (str):          language of the data
         batch_size (int):    batch size for processing, default is 32
         force_run (bool):    if True, force run the experiment, default is False
+        dry_run (bool):      if True, only render the prompts and return the plan from `plan_experiment`
+                             (see `plan_kwargs`), default is False
+        shard_index (int):   index of the shard to run, results are saved to `{group}.shard-{i}-of-{n}.csv`
+                             and combined with `merge_shards`, default is None (no sharding)
+        num_shards (int):    total number of shards, default is None
+        adaptive (dict):     if set, run every protected group in waves with early stopping,
+                             the dict holds `experiment_adaptive` settings (e.g. {"stopping_rule": "ci_width", "ci_width": 0.1}),
+                             default is None (send every record)
+        stream_results (bool): if True, write results incrementally and keep only their count in memory
+                             (see `experiment_core_streaming`), not supported with `adaptive`, default is False
+        name_sample_size (int): if set, inject this many full names per gender for the "name" group
+                             (see `DataInjection`), default is None (10 first names)
+        prompt (str | PromptTemplate | CompiledPrompt): if set, render all prompts of a group at once with `CompiledPrompt`
+                             and send the prompt strings straight to `chain`, default is None (records are rendered by the chain)
+        dispatch (str):      request order, one of `DISPATCH_POLICIES`. "group_id" sends the first variant of every group_id in a
+                             batch one request round before the other variants to warm the backend prefix cache (see `dispatch_batches`);
+                             it only pays off with the `*_attr_last_*` prompts, where the protected attribute comes after the shared
+                             content. Default is "file_order"
+        plan_kwargs (dict):  `plan_experiment` settings for `dry_run` (tokenizer, rpm, tpm, output_tokens, additive), default is None
+        progress (bool):     if True, write `{group}.progress.jsonl` next to every result file for live evaluation
+                             (see `StreamingEvalator.follow`), default is False
     """
+    if dispatch not in DISPATCH_POLICIES:
+        raise ValueError(f"Unknown dispatch policy: {dispatch}, should be one of {DISPATCH_POLICIES}")
+    if adaptive is not None and stream_results:
+        raise ValueError("stream_results is not supported with adaptive, the stopping rule needs all results of a group in memory")
+    if (shard_index is None) != (num_shards is None):
+        raise ValueError("shard_index and num_shards should be set together")
+    if num_shards is not None:
+        if not 0 <= shard_index < num_shards:
+            raise ValueError(f"shard_index should be in [0, {num_shards})")
+        # item_id becomes group_id after injection, so all attribute variants of a CV land on one shard
+        data = data[shard_of(data['item_id'], num_shards) == shard_index].reset_index(drop=True)
+        logger.info(f"Shard {shard_index} of {num_shards}: {len(data)} items")
+
+    if dry_run:
+        # chain is `PROMPTS[key] | llm`, the prompt template is its first step
+        return plan_experiment(prompt if prompt is not None else getattr(chain, "first", chain), data, lang, name_sample_size=name_sample_size, **(plan_kwargs or {}))
+
     logger.info(f"Running experiment for {lang} and saving to {folder_path}.")
     data_paths = {}
     save_root_path = os.path.join(folder_path, lang)
@@ -88,33 +504,139 @@ def run_experiment(folder_path: str,  chain: object, data: pd.DataFrame, lang: s
     if not os.path.exists(save_root_path):
         os.makedirs(save_root_path)
 
-    data_corruption = DataInjection(lang=lang) 
+    data_corruption = DataInjection(lang=lang, name_sample_size=name_sample_size) 
+    compiled_prompt = compile_prompt(prompt) if prompt is not None else None
 
     for group_en, group_uk in zip(PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK):
-        if not force_run and os.path.exists(os.path.join(save_root_path, f"{group_en}.csv")):    
+        file_name = shard_file_name(group_en, shard_index, num_shards)
+        if not force_run and os.path.exists(os.path.join(save_root_path, file_name)):    
             logger.info(f"Skipping {group_en}, already exists")
             continue
         logger.info(f"Running {group_en}")
         corrupted_data = data_corruption.process(data, group_en)
-        corrupted_data_records = corrupted_data.to_dict(orient='records')
-        corrupted_data_records = [{"job_desc": val["Job Description"], "candidate_cv": val["CV"], "protected_group": group_en if lang == "en" else group_uk, "protected_attr": val["protected_attr"]} for val in corrupted_data_records]
+        if compiled_prompt is not None:
+            frame = prompt_frame(corrupted_data, group_en, group_uk, lang)
+            compiled_prompt.check(frame)
+            corrupted_data_records = compiled_prompt.render(frame).tolist()
+        else:
+            corrupted_data_records = corrupted_data.to_dict(orient='records')
+            corrupted_data_records = [{"job_desc": val["Job Description"], "candidate_cv": val["CV"], "protected_group": group_en if lang == "en" else group_uk, "protected_attr": val["protected_attr"]} for val in corrupted_data_records]
 
-        data_paths = experiment_core(corrupted_data, corrupted_data_records, group_en, chain, save_root_path, data_paths, batch_size=batch_size)
+        temp_path = "temp.jsonl" if num_shards is None else f"temp.shard-{shard_index}-of-{num_shards}.jsonl"
+        if adaptive is not None:
+            data_paths = experiment_adaptive(corrupted_data, corrupted_data_records, group_en, chain, save_root_path, data_paths, batch_size=batch_size,
+                                             file_name=file_name, temp_path=temp_path, dispatch=dispatch, progress=progress, **adaptive)
+            continue
+        data_paths = experiment_core(corrupted_data, corrupted_data_records, group_en, chain, save_root_path, data_paths, batch_size=batch_size,
+                                     file_name=file_name, temp_path=temp_path, stream_results=stream_results, dispatch=dispatch,
+                                     progress=progress)
     logger.info(f"Finished experiment for {lang} and saving to {folder_path}.")
     return data_paths
 
-def run_experimment_second_model_verify(folder_path: str,  chain: object, based_on_results: str, lang: str, batch_size: int = 32, force_run: bool = False, test_id: list = None) -> dict:
+def shard_of(group_ids: pd.Series, num_shards: int) -> pd.Series:
+    """
+    Assign ids to shards by a stable hash (the same in every process and machine)
+
+    Args:
+        group_ids (pd.Series):   ids to assign
+        num_shards (int):        total number of shards
+
+    Returns:
+        pd.Series:  shard index per id
+    """
+    return group_ids.map(lambda group_id: int(hashlib.md5(str(group_id).encode("utf-8")).hexdigest()[:16], 16) % num_shards)
+
+def shard_file_name(group_en: str, shard_index: int = None, num_shards: int = None) -> str:
+    """
+    Name of the result file for a protected group (and shard)
+
+    Args:
+        group_en (str):      protected group
+        shard_index (int):   index of the shard, default is None
+        num_shards (int):    total number of shards, default is None
+
+    Returns:
+        str:  file name
+    """
+    if num_shards is None:
+        return f"{group_en}.csv"
+    return f"{group_en}.shard-{shard_index}-of-{num_shards}.csv"
+
+def merge_shards(folder_path: str, lang: str, num_shards: int, data: pd.DataFrame = None, force_run: bool = False, name_sample_size: int = None) -> dict:
+    """
+    Merge shard results into the usual per-group files and verify completeness
+
+    Args:
+        folder_path (str):    path where the shards were stored (same as for `run_experiment`)
+        lang (str):           language of the data
+        num_shards (int):     total number of shards
+        data (pd.DataFrame):  data passed to the shards, if set also verify that every item is present and restore
+                              its order. Default is None (only items found in the shards are checked)
+        force_run (bool):     if True, overwrite already merged files, default is False
+        name_sample_size (int): same as for `run_experiment`, default is None
+
+    Returns:
+        dict:  dictionary with the paths
+    """
+    data_paths = {}
+    save_root_path = os.path.join(folder_path, lang)
+    data_corruption = DataInjection(lang=lang, name_sample_size=name_sample_size)
+    for group_en in PROTECTED_GROUPS_LIST_EN:
+        merged_path = os.path.join(save_root_path, f"{group_en}.csv")
+        if not force_run and os.path.exists(merged_path):
+            logger.info(f"Skipping {group_en}, already merged")
+            data_paths[group_en] = merged_path
+            continue
+
+        shard_paths = [os.path.join(save_root_path, shard_file_name(group_en, i, num_shards)) for i in range(num_shards)]
+        missing_shards = [path for path in shard_paths if not os.path.exists(path)]
+        if missing_shards:
+            raise ValueError(f"Missing shards for {group_en}: {missing_shards}")
+
+        df = pd.concat([pd.read_csv(path, dtype={'protected_attr': str}) for path in shard_paths]).reset_index(drop=True)
+        duplicated = df.duplicated(subset=['group_id', 'protected_attr'])
+        if duplicated.any():
+            raise ValueError(f"{duplicated.sum()} duplicated records in {group_en} shards")
+
+        # every item in the shards has all attribute variants, and with the input data every item is present
+        expected_attr_count = len(data_corruption.get_protected_attr(group_en))
+        attr_count = df.groupby('group_id')['protected_attr'].count()
+        if data is not None:
+            attr_count = attr_count.reindex(data['item_id'].unique(), fill_value=0)
+        incomplete = attr_count[attr_count != expected_attr_count]
+        if len(incomplete) > 0:
+            raise ValueError(f"{len(incomplete)} incomplete items in {group_en}, e.g. {list(incomplete.index[:5])}")
+
+        if data is not None:
+            # restore the order of the unsharded run
+            order = pd.Categorical(df['group_id'], categories=data['item_id'].unique(), ordered=True)
+            df = df.iloc[order.argsort(kind='stable')].reset_index(drop=True)
+
+        df.to_csv(merged_path, index=False)
+        data_paths[group_en] = merged_path
+        logger.info(f"Merged {num_shards} shards of {group_en}: {len(df)} records")
+    return data_paths
+
+def run_experimment_second_model_verify(folder_path: str,  chain: object, based_on_results: str, lang: str, batch_size: int = 32, force_run: bool = False, test_id: list = None,
+                                        selection: Union[str, list] = None, sample_per_attr: int = 50, random_seed: int = 42, incremental: bool = False) -> dict:
     """
     Run experiment for all protected groups
     
     Args:
-        folder_path (str):      path to store the results
-        chain (object):         chain Langchain object
-        based_on_results (str): path to the results of the first model
-        lang (str):             language of the data
-        batch_size (int):       batch size for processing, default is 32
-        force_run (bool):       if True, force run the experiment, default is False
-        test_id (list):         list of test ids to run the experiment. Default is None
+        folder_path (str):        path to store the results
+        chain (object):           chain Langchain object
+        based_on_results (str):   path to the results of the first model
+        lang (str):               language of the data
+        batch_size (int):         batch size for processing, default is 32
+        force_run (bool):         if True, force run the experiment, default is False
+        test_id (list):           list of test ids to run the experiment. Default is None
+        selection (str | list):   policy (or list of policies, rows matching any are verified) from
+                                  `select_for_verification`. Not selected rows keep the first model results
+                                  and are marked with `verified` = False. Default is None (verify all rows)
+        sample_per_attr (int):    number of rows per attribute for the "stratified" policy, default is 50
+        random_seed (int):        random seed for the "stratified" policy, default is 42
+        incremental (bool):       if True, skip rows already verified in the existing results
+                                  (joined on group_id and protected_attr), default is False
     """
     logger.info(f"Running experiment for {lang} and saving to {folder_path}.")
     data_paths = {}
@@ -128,26 +650,132 @@ def run_experimment_second_model_verify(folder_path: str,  chain: object, based_
         raise Exception(f"{based_on_results} folder path not found")
     
     for group_en, group_uk in zip(PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK):
-        if not force_run and os.path.exists(os.path.join(save_root_path, f"{group_en}.csv")):    
+        result_path = os.path.join(save_root_path, f"{group_en}.csv")
+        if not force_run and not incremental and os.path.exists(result_path):    
             logger.info(f"Skipping {group_en}, already exists")
             continue
         corrupted_data = pd.read_csv(os.path.join(based_on_results, lang, f"{group_en}.csv"))
         if test_id is not None:
             corrupted_data = corrupted_data[corrupted_data['group_id'].isin(test_id)]
-        corrupted_data_records = corrupted_data.to_dict(orient='records')
-        corrupted_data_records = [{
-                                    "job_desc": val["Job Description"], 
-                                    "candidate_cv": val["CV"], 
-                                    "protected_group": group_en if lang == "en" else group_uk, 
-                                    "protected_attr": val["protected_attr"],
-                                    "decision": val["decision"],
-                                    "feedback": val["feedback"]
-                                } 
-                                  for val in corrupted_data_records]
-        data_paths = experiment_core(corrupted_data, corrupted_data_records, group_en, chain, save_root_path, data_paths, batch_size=batch_size)
+
+        if selection is None and not incremental:
+            corrupted_data_records = verification_records(corrupted_data, group_en, group_uk, lang)
+            data_paths = experiment_core(corrupted_data, corrupted_data_records, group_en, chain, save_root_path, data_paths, batch_size=batch_size)
+            continue
+
+        corrupted_data = corrupted_data.reset_index(drop=True)
+        to_verify = select_for_verification(corrupted_data, selection, sample_per_attr, random_seed) if selection is not None \
+            else pd.Series(True, index=corrupted_data.index)
+        keys = corrupted_data['group_id'].astype(str) + "|" + corrupted_data['protected_attr'].astype(str)
+
+        previous = None
+        if incremental and not force_run and os.path.exists(result_path):
+            previous = pd.read_csv(result_path)
+            if 'verified' in previous.columns:
+                previous = previous[previous['verified']]
+            previous = previous.assign(verified=True)
+            to_verify &= ~keys.isin(previous['group_id'].astype(str) + "|" + previous['protected_attr'].astype(str))
+            logger.info(f"{len(previous)} rows of {group_en} already verified")
+
+        logger.info(f"Verifying {to_verify.sum()} of {len(corrupted_data)} rows of {group_en}")
+        verified = corrupted_data[to_verify].copy()
+        if len(verified) > 0:
+            batch_file_name = f"{group_en}.verify-batch.csv"
+            experiment_core(verified, verification_records(verified, group_en, group_uk, lang), group_en, chain, save_root_path, {},
+                            batch_size=batch_size, file_name=batch_file_name)
+            # the internal batch leaves its result and cache stats files next to the results
+            for path in [os.path.join(save_root_path, batch_file_name), os.path.join(save_root_path, os.path.splitext(batch_file_name)[0] + ".cache_stats.json")]:
+                if os.path.exists(path):
+                    os.remove(path)
+        verified['verified'] = True
+
+        # rows without a verification result keep the first model result
+        verified_keys = verified['group_id'].astype(str) + "|" + verified['protected_attr'].astype(str)
+        if previous is not None:
+            verified_keys = pd.concat([verified_keys, previous['group_id'].astype(str) + "|" + previous['protected_attr'].astype(str)])
+        unverified = corrupted_data[~keys.isin(verified_keys)].copy()
+        unverified['verified'] = False
+
+        result = pd.concat([frame for frame in [previous, verified, unverified] if frame is not None])
+        # keep the row order of the first model results
+        order = pd.Categorical(result['group_id'].astype(str) + "|" + result['protected_attr'].astype(str), categories=keys.unique(), ordered=True)
+        result = result.iloc[order.argsort(kind='stable')].reset_index(drop=True)
+        result.to_csv(result_path, index=False)
+        data_paths[group_en] = result_path
     logger.info(f"Finished experiment for {lang} and saving to {folder_path}.")
     return data_paths
 
+def verification_records(corrupted_data: pd.DataFrame, group_en: str, group_uk: str, lang: str) -> list:
+    """
+    Build records for the second model verification chain
+
+    Args:
+        corrupted_data (pd.DataFrame):   results of the first model
+        group_en (str):                  protected group in English
+        group_uk (str):                  protected group in Ukrainian
+        lang (str):                      language of the data
+
+    Returns:
+        list:  records
+    """
+    corrupted_data_records = corrupted_data.to_dict(orient='records')
+    return [{
+                "job_desc": val["Job Description"], 
+                "candidate_cv": val["CV"], 
+                "protected_group": group_en if lang == "en" else group_uk, 
+                "protected_attr": val["protected_attr"],
+                "decision": val["decision"],
+                "feedback": val["feedback"]
+            } 
+            for val in corrupted_data_records]
+
+def select_for_verification(df: pd.DataFrame, selection: Union[str, list], sample_per_attr: int = 50, random_seed: int = 42) -> pd.Series:
+    """
+    Select rows of the first model results for verification
+
+    Policies:
+        "disagreement": decision differs from the majority decision of its group_id
+        "unparsed":     decision is missing or is neither hire nor reject
+        "stratified":   random sample of `sample_per_attr` rows per protected attribute
+
+    Args:
+        df (pd.DataFrame):         results of the first model
+        selection (str | list):    policy or list of policies (a row is selected if any policy selects it)
+        sample_per_attr (int):     number of rows per attribute for "stratified", default is 50
+        random_seed (int):         random seed for "stratified", default is 42
+
+    Returns:
+        pd.Series:  boolean mask of selected rows
+    """
+    policies = [selection] if isinstance(selection, str) else list(selection)
+    decisions = df['decision'].map(normalize_decision)
+    mask = pd.Series(False, index=df.index)
+    for policy in policies:
+        if policy == "disagreement":
+            mask |= majority_bias_flags(pd.DataFrame({'group_id': df['group_id'], 'decision': decisions})).astype(bool)
+        elif policy == "unparsed":
+            mask |= ~decisions.isin(["hire", "reject"])
+        elif policy == "stratified":
+            sample = df.sample(frac=1, random_state=random_seed).groupby('protected_attr').head(sample_per_attr)
+            mask |= df.index.isin(sample.index)
+        else:
+            raise ValueError(f"Unknown selection policy: {policy}")
+    return mask
+
+class GeneratedMessage:
+    """Model output in the shape of a Langchain chat message, as read by `process_output`"""
+    def __init__(self, content: str) -> None:
+        """
+        Initialize GeneratedMessage class
+
+        Args:
+            content (str): generated text
+
+        Returns:
+            None
+        """
+        self.content = content
+
 def process_output(generated_results: list[object]) -> list:
     """
     Method for processing the generated results
@@ -165,4 +793,4 @@ def process_output(generated_results: list[object]) -> list:
             processed_results.append(json.loads(res))
         except:
             processed_results.append(result.content)
-    return processed_results
\ No newline at end of file
+    return processed_results
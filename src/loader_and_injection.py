@@ -2,8 +2,9 @@ import json
 import random
 import logging
 import datasets
+import numpy as np
 import pandas as pd 
-from src.helpers import protected_groups_uk, protected_groups_en, load_names
+from src.helpers import protected_groups_uk, protected_groups_en, load_names, sample_full_names
 from src.constants import DATA_PATH, MATCHER_PATH, PRIMARY_POSITIONS, PROTECTED_GROUPS
 
 logger = logging.getLogger("loader_and_corruption")
@@ -199,17 +200,22 @@ class DataLoader:
 
 class DataInjection:
     """class for injection data for specific protected groups"""
-    def __init__(self, lang: str = 'uk'):
+    def __init__(self, lang: str = 'uk', name_sample_size: int = None, random_seed: int = 42):
         """
         Initialize DataInjection class
         
         Args:
-            lang (str): language of the data, default is 'uk'
+            lang (str):               language of the data, default is 'uk'
+            name_sample_size (int):   if set, the "name" group uses this many full (first + last) names per gender
+                                      sampled from the name lexicons, default is None (10 first names)
+            random_seed (int):        random seed for name sampling, default is 42
             
         Returns:
             None
         """
         self.lang = lang
+        self.name_sample_size = name_sample_size
+        self.random_seed = random_seed
 
     def process(self, df: pd.DataFrame, protected_group: str) -> pd.DataFrame:
         """
@@ -238,6 +244,8 @@ class DataInjection:
         """
         if protected_group == "age":
             protected_attr = [20, 30, 40, 50, 60, 70]
+        elif protected_group == "name" and self.name_sample_size is not None:
+            protected_attr = sample_full_names(self.lang, self.name_sample_size, self.random_seed)
         elif protected_group == "name":
             # 10 names: 5 males and 5 females
             protected_attr = load_names(self.lang, 10)
@@ -258,25 +266,22 @@ class DataInjection:
         Returns:
             pd.DataFrame:  corrupted data
         """
-        data = []
-        for group_item in df.to_dict('records'):
-            for attr in protected_attr:
-                group_item_copy = group_item.copy()
-                group_item_copy['protected_group'] = protected_group
-                group_item_copy['protected_attr'] = attr
-                group_item_copy['group_id'] = group_item_copy['item_id']    
-
-                if protected_group == "gender" and self.lang == "uk":
-                    if attr == "Чоловік":
-                        group_item_copy['CV'] = group_item_copy['CV_male_marked'] 
-                    elif attr == "Жінка":
-                        group_item_copy['CV'] = group_item_copy['CV_female_marked']
-                del group_item_copy['item_id']
-                if 'CV_male_marked' in group_item_copy and 'CV_female_marked' in group_item_copy:
-                    del group_item_copy['CV_male_marked'], group_item_copy['CV_female_marked']
-
-                data.append(group_item_copy)
-        return pd.DataFrame(data)
+        # repeat rows instead of copying records: text columns keep references to the same strings
+        rows = np.repeat(np.arange(len(df)), len(protected_attr))
+        data = df.iloc[rows].reset_index(drop=True)
+        data['protected_group'] = protected_group
+        data['protected_attr'] = pd.Series(protected_attr).iloc[np.tile(np.arange(len(protected_attr)), len(df))].to_numpy()
+        data['group_id'] = data['item_id']
+
+        if protected_group == "gender" and self.lang == "uk":
+            is_male = data['protected_attr'] == "Чоловік"
+            is_female = data['protected_attr'] == "Жінка"
+            data.loc[is_male, 'CV'] = data.loc[is_male, 'CV_male_marked']
+            data.loc[is_female, 'CV'] = data.loc[is_female, 'CV_female_marked']
+        data = data.drop(columns=['item_id'])
+        if 'CV_male_marked' in data.columns and 'CV_female_marked' in data.columns:
+            data = data.drop(columns=['CV_male_marked', 'CV_female_marked'])
+        return data
 
     @staticmethod
     def _load_txt(path: str) -> list:
@@ -0,0 +1,168 @@
+import logging
+import torch
+from typing import Union
+from langchain import PromptTemplate
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from src.prompt import CompiledPrompt, compile_prompt
+from src.experiment_runner import GeneratedMessage
+
+logger = logging.getLogger("local_backend")
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
+
+file_handler = logging.FileHandler('logs.log')
+file_handler.setLevel(logging.DEBUG)
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+
+class LocalHFChain:
+    """
+    In-process Hugging Face causal LM with the `batch` interface of a Langchain chain,
+    so it can be passed as `chain` to `run_experiment`.
+
+    For CI a tiny randomly initialized model works offline with any local tokenizer
+    (see `tests/test_local_backend.py`), e.g.:
+        config = GPT2Config(vocab_size=len(tokenizer), n_positions=256, n_embd=32, n_layer=1, n_head=2)
+        chain = LocalHFChain("baseline_prompt_en", GPT2LMHeadModel(config), tokenizer, max_new_tokens=8)
+    """
+    def __init__(self,
+                 prompt: Union[str, PromptTemplate, CompiledPrompt, None],
+                 model: Union[str, object],
+                 tokenizer: object = None,
+                 max_new_tokens: int = 128,
+                 max_batch_size: int = 8,
+                 max_batch_tokens: int = 16384,
+                 use_chat_template: bool = False,
+                 device: str = "cpu") -> None:
+        """
+        Initialize LocalHFChain class
+
+        Args:
+            prompt (str | PromptTemplate | CompiledPrompt | None): key in `PROMPTS`, prompt template or compiled prompt
+                                                                   to render records, None if records are already rendered prompt strings
+            model (str | object):                                  model name in Hugging Face Hub or a loaded causal LM
+            tokenizer (object):                                    tokenizer, default is None (loaded from the model name)
+            max_new_tokens (int):                                  max number of generated tokens, default is 128
+            max_batch_size (int):                                  max prompts per generation batch, default is 8
+            max_batch_tokens (int):                                max padded prompt tokens per batch, default is 16384
+            use_chat_template (bool):                              wrap the prompt into the tokenizer chat template as a user message,
+                                                                   default is False
+            device (str):                                          torch device, default is "cpu"
+
+        Returns:
+            None
+        """
+        self.prompt = compile_prompt(prompt) if prompt is not None else None
+        if isinstance(model, str):
+            tokenizer = tokenizer or AutoTokenizer.from_pretrained(model)
+            model = AutoModelForCausalLM.from_pretrained(model)
+        if tokenizer is None:
+            raise ValueError("tokenizer is required when the model is passed as an object")
+        self.model = model.to(device).eval()
+        self.tokenizer = tokenizer
+        # decoder-only models continue the last token, so pad on the left
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.max_new_tokens = max_new_tokens
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.use_chat_template = use_chat_template
+        self.device = device
+
+    def render(self, inputs: list) -> list[str]:
+        """
+        Render records into prompt texts
+
+        Args:
+            inputs (list): records with prompt input variables or rendered prompt strings
+
+        Returns:
+            list[str]: prompt texts
+        """
+        if self.prompt is None and not all(isinstance(item, str) for item in inputs):
+            raise ValueError("Records should be rendered prompt strings when the chain has no prompt")
+        texts = [item if isinstance(item, str) else self.prompt.format(**item) for item in inputs]
+        if self.use_chat_template:
+            texts = [
+                self.tokenizer.apply_chat_template([{"role": "user", "content": text}], tokenize=False, add_generation_prompt=True)
+                for text in texts
+            ]
+        return texts
+
+    def length_batches(self, lengths: list[int]) -> list[list[int]]:
+        """
+        Group prompts of similar length into batches bounded by size and padded token count
+
+        Args:
+            lengths (list[int]): prompt length in tokens
+
+        Returns:
+            list[list[int]]: indices of prompts per batch
+        """
+        order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+        batches, batch = [], []
+        for i in order:
+            # prompts are sorted by length, so the first one of the batch sets the padded length
+            padded_length = lengths[batch[0]] if batch else lengths[i]
+            if batch and (len(batch) >= self.max_batch_size or (len(batch) + 1) * padded_length > self.max_batch_tokens):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @torch.no_grad()
+    def generate(self, texts: list[str]) -> list[str]:
+        """
+        Generate completions for a batch of prompt texts
+
+        Args:
+            texts (list[str]): prompt texts
+
+        Returns:
+            list[str]: generated texts (without the prompt)
+        """
+        encoded = self.tokenizer(texts, padding=True, return_tensors="pt", add_special_tokens=not self.use_chat_template).to(self.device)
+        output = self.model.generate(
+            **encoded,
+            max_new_tokens=self.max_new_tokens,
+            do_sample=False,
+            pad_token_id=self.tokenizer.pad_token_id,
+        )
+        return self.tokenizer.batch_decode(output[:, encoded["input_ids"].shape[1]:], skip_special_tokens=True)
+
+    def batch(self, inputs: list, config: dict = None) -> list[GeneratedMessage]:
+        """
+        Generate answers for records (same interface as Langchain `chain.batch`)
+
+        Args:
+            inputs (list):   records with prompt input variables or rendered prompt strings
+            config (dict):   Langchain config, ignored (batching is defined by the class settings)
+
+        Returns:
+            list[GeneratedMessage]: answers in the order of the inputs
+        """
+        texts = self.render(inputs)
+        lengths = [len(ids) for ids in self.tokenizer(texts, add_special_tokens=not self.use_chat_template)["input_ids"]]
+        outputs = [None] * len(texts)
+        for batch in self.length_batches(lengths):
+            for i, generated in zip(batch, self.generate([texts[i] for i in batch])):
+                outputs[i] = GeneratedMessage(generated)
+        return outputs
+
+    def invoke(self, input: Union[dict, str], config: dict = None) -> GeneratedMessage:
+        """
+        Generate an answer for one record
+
+        Args:
+            input (dict | str):   record with prompt input variables or rendered prompt string
+            config (dict):        Langchain config, ignored
+
+        Returns:
+            GeneratedMessage: answer
+        """
+        return self.batch([input])[0]
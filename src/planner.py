@@ -0,0 +1,165 @@
+import logging
+import numpy as np
+import pandas as pd
+from typing import Callable, Union
+from langchain import PromptTemplate
+
+from src.prompt import CompiledPrompt, compile_prompt
+from src.loader_and_injection import DataInjection
+from src.constants import PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK
+
+logger = logging.getLogger("planner")
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
+
+file_handler = logging.FileHandler('logs.log')
+file_handler.setLevel(logging.DEBUG)
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+APPROX_TOKEN_PATTERN = r"\w+|[^\w\s]"
+
+
+def approx_token_count(texts: pd.Series) -> pd.Series:
+    """
+    Approximate token count: one token per word and per punctuation sign
+
+    Args:
+        texts (pd.Series):   rendered prompts
+
+    Returns:
+        pd.Series:  number of tokens per prompt
+    """
+    return texts.str.count(APPROX_TOKEN_PATTERN)
+
+
+def segment_token_counts(prompt: CompiledPrompt, frame: pd.DataFrame, tokenizer: Callable[[pd.Series], pd.Series], cache: dict = None) -> pd.Series:
+    """
+    Token count per prompt without rendering it: static segments are counted once, every distinct field value
+    (job description, CV, protected attribute) once, and the counts of the segments are added per record
+
+    Args:
+        prompt (CompiledPrompt):   compiled prompt
+        frame (pd.DataFrame):      input variables, one column per template variable
+        tokenizer (callable):      maps a series of texts to a series of token counts
+        cache (dict):              text -> token count, shared between calls to count every text only once, default is None
+
+    Returns:
+        pd.Series:  number of tokens per prompt
+    """
+    cache = {} if cache is None else cache
+    counts = np.zeros(len(frame), dtype=np.int64)
+    for text, field, format_spec in prompt.segments:
+        if field is None:
+            codes, texts = np.zeros(len(frame), dtype=np.int64), [text]
+        else:
+            codes, uniques = pd.factorize(frame[field], use_na_sentinel=False)
+            texts = [format(value, format_spec) for value in uniques]
+        new_texts = list(dict.fromkeys(text for text in texts if text not in cache))
+        if new_texts:
+            cache.update(zip(new_texts, np.asarray(tokenizer(pd.Series(new_texts, dtype=object)), dtype=np.int64).tolist()))
+        counts += np.array([cache[text] for text in texts], dtype=np.int64)[codes]
+    return pd.Series(counts, index=frame.index)
+
+
+def rendered_token_counts(prompt: CompiledPrompt, frame: pd.DataFrame, tokenizer: Callable[[pd.Series], pd.Series], chunk_size: int = 10000) -> pd.Series:
+    """
+    Token count per fully rendered prompt, rendered in chunks of rows to bound memory
+
+    Args:
+        prompt (CompiledPrompt):   compiled prompt
+        frame (pd.DataFrame):      input variables, one column per template variable
+        tokenizer (callable):      maps a series of prompts to a series of token counts
+        chunk_size (int):          rows rendered at once, default is 10000
+
+    Returns:
+        pd.Series:  number of tokens per prompt
+    """
+    counts = [pd.Series(np.asarray(tokenizer(rendered), dtype=np.int64), index=rendered.index)
+              for rendered in (prompt.render(frame.iloc[start:start + chunk_size]) for start in range(0, len(frame), chunk_size))]
+    return pd.concat(counts) if counts else pd.Series([], dtype=np.int64)
+
+
+def prompt_frame(corrupted_data: pd.DataFrame, group_en: str, group_uk: str, lang: str) -> pd.DataFrame:
+    """
+    Build prompt input variables for the injected data (same as records in `run_experiment`)
+
+    Args:
+        corrupted_data (pd.DataFrame):   injected data for one protected group
+        group_en (str):                  protected group name in English
+        group_uk (str):                  protected group name in Ukrainian
+        lang (str):                      language of the data
+
+    Returns:
+        pd.DataFrame:  prompt input variables, one row per request
+    """
+    return pd.DataFrame({
+        "job_desc": corrupted_data["Job Description"],
+        "candidate_cv": corrupted_data["CV"],
+        "protected_group": group_en if lang == "en" else group_uk,
+        "protected_attr": corrupted_data["protected_attr"],
+    })
+
+
+def plan_experiment(prompt: Union[str, PromptTemplate, CompiledPrompt],
+                    data: pd.DataFrame,
+                    lang: str,
+                    tokenizer: Callable[[pd.Series], pd.Series] = None,
+                    rpm: int = 500,
+                    tpm: int = 200000,
+                    output_tokens: int = 60,
+                    name_sample_size: int = None,
+                    additive: bool = True) -> pd.DataFrame:
+    """
+    Dry run of `run_experiment`: count the tokens of every prompt and estimate requests, tokens and wall time.
+    Nothing is sent to the model.
+
+    Args:
+        prompt (str | PromptTemplate | CompiledPrompt):   key in `PROMPTS`, prompt template or compiled prompt
+        data (pd.DataFrame):                              data to process (before injection)
+        lang (str):                                       language of the data
+        tokenizer (callable):                             maps a series of prompts to a series of token counts,
+                                                          default is `approx_token_count`
+        rpm (int):                                        requests per minute budget, default is 500
+        tpm (int):                                        tokens per minute budget, default is 200000
+        output_tokens (int):                              expected output tokens per request, default is 60
+        name_sample_size (int):                           full names per gender for the "name" group (see `DataInjection`),
+                                                          default is None (10 first names)
+        additive (bool):                                  if True, add up token counts of prompt segments (see `segment_token_counts`),
+                                                          exact for `approx_token_count` when fields border whitespace or punctuation,
+                                                          a close estimate for subword tokenizers. If False, tokenize fully rendered
+                                                          prompts (see `rendered_token_counts`). Default is True
+
+    Returns:
+        pd.DataFrame:  plan per protected group with a total row
+    """
+    prompt = compile_prompt(prompt)
+    tokenizer = tokenizer or approx_token_count
+    data_corruption = DataInjection(lang=lang, name_sample_size=name_sample_size)
+
+    plan, cache = [], {}
+    for group_en, group_uk in zip(PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK):
+        frame = prompt_frame(data_corruption.process(data, group_en), group_en, group_uk, lang)
+        input_tokens = segment_token_counts(prompt, frame, tokenizer, cache) if additive else rendered_token_counts(prompt, frame, tokenizer)
+        plan.append({
+            "protected_group": group_en,
+            "requests": len(frame),
+            "total_input_tokens": int(input_tokens.sum()),
+            "max_input_tokens": int(input_tokens.max()) if len(input_tokens) else 0,
+            "mean_input_tokens": round(float(input_tokens.mean()), 1) if len(input_tokens) else 0.0,
+            "total_output_tokens": len(frame) * output_tokens,
+        })
+
+    df_plan = pd.DataFrame(plan)
+    total = {column: int(df_plan[column].sum()) for column in ["requests", "total_input_tokens", "total_output_tokens"]}
+    total["max_input_tokens"] = int(df_plan["max_input_tokens"].max())
+    total["mean_input_tokens"] = round(total["total_input_tokens"] / max(total["requests"], 1), 1)
+    df_plan = pd.concat([df_plan, pd.DataFrame([{"protected_group": "total", **total}])]).reset_index(drop=True)
+
+    # wall time is bounded by whichever of the request and token budgets is exhausted first
+    df_plan["estimated_minutes"] = [
+        round(max(requests / rpm, (input_tokens + output) / tpm), 2)
+        for requests, input_tokens, output in zip(df_plan["requests"], df_plan["total_input_tokens"], df_plan["total_output_tokens"])
+    ]
+    logger.info(f"Planned {total['requests']} requests, {total['total_input_tokens']} input tokens for {lang}.")
+    return df_plan
@@ -1,7 +1,10 @@
+import string
+import numpy as np
+import pandas as pd
 from langchain import PromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field, validator
-from typing import List
+from typing import List, Union
 
 
 class HireDecisionEn(BaseModel):
@@ -306,4 +309,141 @@ Structure output in this format: ```
         input_variables=['job_desc', 'candidate_cv', 'protected_group', 'protected_attr', 'decision', 'feedback'],
         partial_variables={'format_instructions': hire_decision_uk_output_parser.get_format_instructions()}
     ),
-}
\ No newline at end of file
+}
+
+
+# protected attribute line of the candidate profile in every template
+ATTRIBUTE_LINES = {
+    "en": "Candidate's {protected_group}: {protected_attr}\n",
+    "uk": "{protected_group} кандидата: {protected_attr}\n",
+}
+
+
+def attribute_last_prompt(prompt: PromptTemplate) -> PromptTemplate:
+    """
+    Move the protected attribute line after the CV, so all attribute variants of a CV share the prompt
+    prefix up to the attribute (friendly to backend prefix caches)
+
+    Args:
+        prompt (PromptTemplate): prompt template from `PROMPTS`
+
+    Returns:
+        PromptTemplate: prompt template with the attribute line after the CV
+    """
+    for line in ATTRIBUTE_LINES.values():
+        if line + "{candidate_cv}\n" in prompt.template:
+            return PromptTemplate(
+                template=prompt.template.replace(line + "{candidate_cv}\n", "{candidate_cv}\n" + line),
+                input_variables=prompt.input_variables,
+                partial_variables=prompt.partial_variables,
+            )
+    raise ValueError("Protected attribute line is not followed by the CV in the template")
+
+
+# e.g. "baseline_prompt_attr_last_en"
+PROMPTS.update({f"{key[:-3]}_attr_last{key[-3:]}": attribute_last_prompt(prompt) for key, prompt in list(PROMPTS.items())})
+
+
+class CompiledPrompt:
+    """Prompt template split once into static segments and input fields, rendered column-wise for whole groups"""
+    def __init__(self, prompt: PromptTemplate) -> None:
+        """
+        Initialize CompiledPrompt class
+
+        Args:
+            prompt (PromptTemplate): prompt template (f-string format)
+
+        Returns:
+            None
+        """
+        self.prompt = prompt
+        partial_variables = {key: value() if callable(value) else value for key, value in prompt.partial_variables.items()}
+        # (text, field, format_spec): static text has field None, partial variables are merged into static text
+        self.segments = []
+        for literal, field, format_spec, conversion in string.Formatter().parse(prompt.template):
+            if conversion:
+                raise ValueError(f"Conversions are not supported: {{{field}!{conversion}}}")
+            if literal:
+                self._add_static(literal)
+            if field is None:
+                continue
+            if field in partial_variables:
+                self._add_static(format(partial_variables[field], format_spec or ""))
+            else:
+                self.segments.append((None, field, format_spec or ""))
+        self.input_variables = list(dict.fromkeys(field for _, field, _ in self.segments if field is not None))
+
+    def _add_static(self, text: str) -> None:
+        if self.segments and self.segments[-1][1] is None:
+            self.segments[-1] = (self.segments[-1][0] + text, None, "")
+        else:
+            self.segments.append((text, None, ""))
+
+    def render(self, frame: pd.DataFrame) -> pd.Series:
+        """
+        Render the prompt for every row of the frame
+
+        Args:
+            frame (pd.DataFrame): input variables, one column per template variable
+
+        Returns:
+            pd.Series: rendered prompts
+        """
+        # every column is converted to text once, even if the template uses it several times
+        columns = {}
+        for _, field, format_spec in self.segments:
+            if field is not None and (field, format_spec) not in columns:
+                values = frame[field].to_numpy(dtype=object)
+                columns[(field, format_spec)] = np.array([format(value, format_spec) for value in values], dtype=object)
+        rendered = np.full(len(frame), "", dtype=object)
+        for text, field, format_spec in self.segments:
+            rendered = rendered + (text if field is None else columns[(field, format_spec)])
+        return pd.Series(rendered, index=frame.index, dtype=object)
+
+    def format(self, **kwargs) -> str:
+        """
+        Render the prompt for one record
+
+        Returns:
+            str: rendered prompt
+        """
+        return "".join(text if field is None else format(kwargs[field], format_spec) for text, field, format_spec in self.segments)
+
+    def check(self, frame: pd.DataFrame, n: int = 100) -> None:
+        """
+        Check that the output is identical to the template output on the first n rows
+
+        Args:
+            frame (pd.DataFrame): input variables
+            n (int):              number of rows to check, default is 100
+
+        Returns:
+            None
+        """
+        sample = frame.head(n)
+        for record, rendered in zip(sample[self.input_variables].to_dict('records'), self.render(sample)):
+            if self.prompt.format(**record) != rendered:
+                raise ValueError(f"Compiled prompt differs from the template for {record}")
+
+
+COMPILED_PROMPTS = {key: CompiledPrompt(prompt) for key, prompt in PROMPTS.items()}
+
+
+def compile_prompt(prompt: Union[str, PromptTemplate, CompiledPrompt]) -> CompiledPrompt:
+    """
+    Get the compiled prompt for a key in `PROMPTS` or a template
+
+    Args:
+        prompt (str | PromptTemplate | CompiledPrompt): key in `PROMPTS`, prompt template or compiled prompt
+
+    Returns:
+        CompiledPrompt: compiled prompt
+    """
+    if isinstance(prompt, CompiledPrompt):
+        return prompt
+    if isinstance(prompt, str):
+        return COMPILED_PROMPTS[prompt]
+    for key, template in PROMPTS.items():
+        if template is prompt:
+            return COMPILED_PROMPTS[key]
+    return CompiledPrompt(prompt)
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+from statistics import NormalDist
+
+from src.bootstrap import attribute_matrices
+
+STOPPING_RULES = ["ci_width", "sequential"]
+
+
+def cluster_mean_ci(values: np.ndarray, z: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Mean and CI half-width per column, with group_ids (rows) as independent clusters
+
+    Args:
+        values (np.ndarray):   group_id x statistic matrix (NaN where missing)
+        z (float):             normal quantile of the interval
+
+    Returns:
+        tuple: means and half-widths per column
+    """
+    counts = (~np.isnan(values)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.nanmean(values, axis=0)
+        std = np.nanstd(values, axis=0, ddof=1)
+        half_widths = z * std / np.sqrt(counts)
+    return means, np.where(counts > 1, half_widths, np.inf)
+
+
+def stopping_check(df: pd.DataFrame,
+                   stopping_rule: str = "ci_width",
+                   ci_width: float = 0.1,
+                   alpha: float = 0.05,
+                   margin: float = 0.05,
+                   n_looks: int = 1) -> dict:
+    """
+    Check whether per-attribute approval and bias estimates are stable enough to stop a protected group
+
+    Rules:
+        "ci_width":   every approval and bias CI (level 1 - alpha) is narrower than `ci_width`
+        "sequential": for every attribute the paired gap to the group_id mean approval is either significant
+                      or within +-`margin` (equivalence), with alpha split over `n_looks` looks (Bonferroni)
+
+    Args:
+        df (pd.DataFrame):     results processed so far with `group_id`, `protected_attr`, `decision`
+        stopping_rule (str):   rule from `STOPPING_RULES`, default is "ci_width"
+        ci_width (float):      max CI width for "ci_width", default is 0.1
+        alpha (float):         error rate, default is 0.05
+        margin (float):        equivalence margin for "sequential", default is 0.05
+        n_looks (int):         planned number of looks for "sequential", default is 1
+
+    Returns:
+        dict: stop flag and current estimates
+    """
+    if stopping_rule not in STOPPING_RULES:
+        raise ValueError(f"Unknown stopping rule: {stopping_rule}")
+    attrs, hire, bias = attribute_matrices(df)
+
+    if stopping_rule == "ci_width":
+        z = NormalDist().inv_cdf(1 - alpha / 2)
+        hire_means, hire_half = cluster_mean_ci(hire, z)
+        bias_means, bias_half = cluster_mean_ci(bias, z)
+        stop = bool(np.all(2 * hire_half <= ci_width) and np.all(2 * bias_half <= ci_width))
+        criterion = {attr: round(float(2 * max(hire_half[i], bias_half[i])), 4) for i, attr in enumerate(attrs)}
+    else:
+        z = NormalDist().inv_cdf(1 - alpha / (2 * n_looks))
+        gaps = hire - np.nanmean(hire, axis=1, keepdims=True)
+        gap_means, gap_half = cluster_mean_ci(gaps, z)
+        significant = np.abs(gap_means) - gap_half > 0
+        equivalent = np.abs(gap_means) + gap_half < margin
+        stop = bool(np.all(significant | equivalent))
+        criterion = {attr: round(float(gap_means[i]), 4) for i, attr in enumerate(attrs)}
+        hire_means, _ = cluster_mean_ci(hire, z)
+        bias_means, _ = cluster_mean_ci(bias, z)
+
+    return {
+        "stop": stop,
+        "group_ids": int(hire.shape[0]),
+        "mean_reject_approve_per_attr": {attr: round(float(hire_means[i]), 4) for i, attr in enumerate(attrs)},
+        "mean_bias_per_attr": {attr: round(float(bias_means[i]), 4) for i, attr in enumerate(attrs)},
+        "criterion_per_attr": criterion,
+    }
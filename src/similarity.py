@@ -0,0 +1,250 @@
+import re
+import zlib
+import weakref
+import numpy as np
+
+EMBEDDING_RUNTIMES = ["torch", "onnx", "int8"]
+# max absolute difference of pairwise similarity allowed for optimized runtimes vs the fp32 model
+EMBEDDING_TOLERANCE = 0.02
+
+
+def load_embedding_model(emb_model_name: str, runtime: str = "torch") -> object:
+    """
+    Load a SentenceTransformer
+
+    Args:
+        emb_model_name (str):   Name of the embedding model to use
+        runtime (str):          "torch" (fp32 on the automatically chosen device, GPU if available), or the CPU runtimes
+                                "onnx" (ONNX Runtime, needs sentence-transformers>=3.2 and optimum) and
+                                "int8" (torch dynamic int8 quantization of linear layers), default is "torch"
+
+    Returns:
+        object: SentenceTransformer model
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if runtime == "torch":
+        return SentenceTransformer(emb_model_name)
+    if runtime == "onnx":
+        return SentenceTransformer(emb_model_name, device="cpu", backend="onnx")
+    if runtime == "int8":
+        import torch
+        model = SentenceTransformer(emb_model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    raise ValueError(f"Unknown embedding runtime: {runtime}")
+
+
+def group_pair_index(group_codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Indices of all pairs of items within the same group
+
+    Args:
+        group_codes (np.ndarray):   group code per item
+
+    Returns:
+        tuple: first and second item index of every pair
+    """
+    order = np.argsort(group_codes, kind="stable")
+    _, starts, sizes = np.unique(group_codes[order], return_index=True, return_counts=True)
+    first, second = [], []
+    triu_cache = {}
+    for start, size in zip(starts, sizes):
+        if size not in triu_cache:
+            triu_cache[size] = np.triu_indices(size, k=1)
+        i, j = triu_cache[size]
+        first.append(order[start + i])
+        second.append(order[start + j])
+    if not first:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    return np.concatenate(first), np.concatenate(second)
+
+
+def chunked_pair_scores(score: callable, first: np.ndarray, second: np.ndarray, chunk_size: int = 10000) -> np.ndarray:
+    """
+    Apply a row-wise pair score in chunks of pairs to bound memory
+
+    Args:
+        score (callable):      maps (first index, second index) arrays to scores
+        first (np.ndarray):    first item index of every pair
+        second (np.ndarray):   second item index of every pair
+        chunk_size (int):      pairs per chunk, default is 10000
+
+    Returns:
+        np.ndarray: score per pair
+    """
+    if len(first) == 0:
+        return np.array([], dtype=float)
+    return np.concatenate([score(first[i:i + chunk_size], second[i:i + chunk_size]) for i in range(0, len(first), chunk_size)])
+
+
+class EmbeddingSimilarity:
+    """Cosine similarity of sentence embeddings"""
+    def __init__(self, emb_model: object, batch_size: int = 32, pool_size: int = 0, sort_by_length: bool = True) -> None:
+        """
+        Init method for the class
+
+        Args:
+            emb_model (object):     SentenceTransformer (or any model with `encode(list[str])`)
+            batch_size (int):       encode batch size, default is 32
+            pool_size (int):        number of CPU worker processes for encoding, default is 0 (encode in this process)
+            sort_by_length (bool):  with `pool_size` > 1, sort texts by length before they are split into worker chunks,
+                                    so every worker gets texts of similar length, default is True. A single process
+                                    needs no sorting, `SentenceTransformer.encode` sorts by length itself
+
+        Returns:
+            None
+        """
+        self.emb_model = emb_model
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+        self.sort_by_length = sort_by_length
+        self.pool = None
+
+    def _start_pool(self) -> None:
+        self.pool = self.emb_model.start_multi_process_pool(["cpu"] * self.pool_size)
+        weakref.finalize(self, self.emb_model.stop_multi_process_pool, self.pool)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """
+        Encode texts into l2-normalized embeddings
+
+        Args:
+            texts (list[str]):   texts
+
+        Returns:
+            np.ndarray: text x dim matrix
+        """
+        if self.pool_size > 1:
+            if self.pool is None:
+                self._start_pool()
+            # chunks are sent to workers in order, so every worker gets texts of similar length
+            order = np.argsort([-len(text) for text in texts], kind="stable") if self.sort_by_length else np.arange(len(texts))
+            sorted_emb = np.asarray(self.emb_model.encode_multi_process([texts[i] for i in order], self.pool, batch_size=self.batch_size), dtype=np.float32)
+            emb = np.empty_like(sorted_emb)
+            emb[order] = sorted_emb
+        else:
+            emb = np.asarray(self.emb_model.encode(texts, batch_size=self.batch_size), dtype=np.float32)
+        return emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+
+    def group_similarities(self, texts: list[str], group_codes: np.ndarray) -> np.ndarray:
+        """
+        Similarities of all pairs of texts within the same group, computed in one pass over all texts
+
+        Args:
+            texts (list[str]):          texts
+            group_codes (np.ndarray):   group code per text
+
+        Returns:
+            np.ndarray: similarity per pair
+        """
+        emb = self.encode(texts)
+        first, second = group_pair_index(group_codes)
+        return chunked_pair_scores(lambda i, j: np.einsum("ij,ij->i", emb[i], emb[j]), first, second)
+
+
+class TfidfSimilarity:
+    """Cosine similarity of sparse TF-IDF vectors (fitted on the texts of one protected group)"""
+    def __init__(self, ngram_range: tuple[int, int] = (1, 2), sublinear_tf: bool = True) -> None:
+        """
+        Init method for the class
+
+        Args:
+            ngram_range (tuple):    word n-gram range, default is (1, 2)
+            sublinear_tf (bool):    use 1 + log(tf), default is True
+
+        Returns:
+            None
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        self.vectorizer = TfidfVectorizer(ngram_range=ngram_range, sublinear_tf=sublinear_tf)
+
+    def group_similarities(self, texts: list[str], group_codes: np.ndarray) -> np.ndarray:
+        first, second = group_pair_index(group_codes)
+        try:
+            matrix = self.vectorizer.fit_transform(texts).tocsr()
+        except ValueError:
+            # empty vocabulary (no text has a word): zero vectors, the score an empty text gets against any other text
+            return np.zeros(len(first), dtype=float)
+        # rows are l2-normalized, so the cosine is the row-wise dot product
+        return chunked_pair_scores(lambda i, j: np.asarray(matrix[i].multiply(matrix[j]).sum(axis=1)).ravel(), first, second)
+
+
+class MinHashSimilarity:
+    """MinHash estimate of the Jaccard similarity of word shingle sets"""
+    MERSENNE_PRIME = (1 << 31) - 1
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 1, random_seed: int = 42, perm_chunk: int = 16) -> None:
+        """
+        Init method for the class
+
+        Args:
+            num_perm (int):       number of hash permutations, default is 128
+            shingle_size (int):   words per shingle, default is 1
+            random_seed (int):    random seed of the permutations, default is 42
+            perm_chunk (int):     permutations computed at once (bounds memory), default is 16
+
+        Returns:
+            None
+        """
+        rng = np.random.default_rng(random_seed)
+        self.a = rng.integers(1, self.MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, self.MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.shingle_size = shingle_size
+        self.perm_chunk = perm_chunk
+
+    def _shingles(self, text: str) -> list[int]:
+        words = re.findall(r"\w+", str(text).lower())
+        shingles = [" ".join(words[i:i + self.shingle_size]) for i in range(max(len(words) - self.shingle_size + 1, 1))]
+        return [zlib.crc32(shingle.encode("utf-8")) & self.MERSENNE_PRIME for shingle in shingles]
+
+    def signatures(self, texts: list[str]) -> np.ndarray:
+        """
+        MinHash signatures of all texts
+
+        Args:
+            texts (list[str]):   texts
+
+        Returns:
+            np.ndarray: text x permutation matrix
+        """
+        hashes = [self._shingles(text) for text in texts]
+        lengths = np.array([len(item) for item in hashes])
+        values = np.fromiter((value for item in hashes for value in item), dtype=np.uint64, count=int(lengths.sum()))
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        signatures = np.empty((len(texts), len(self.a)), dtype=np.uint64)
+        for chunk_start in range(0, len(self.a), self.perm_chunk):
+            a = self.a[chunk_start:chunk_start + self.perm_chunk, None]
+            b = self.b[chunk_start:chunk_start + self.perm_chunk, None]
+            permuted = (a * values[None, :] + b) % np.uint64(self.MERSENNE_PRIME)
+            signatures[:, chunk_start:chunk_start + self.perm_chunk] = np.minimum.reduceat(permuted, starts, axis=1).T
+        return signatures
+
+    def group_similarities(self, texts: list[str], group_codes: np.ndarray) -> np.ndarray:
+        signatures = self.signatures(texts)
+        first, second = group_pair_index(group_codes)
+        return chunked_pair_scores(lambda i, j: (signatures[i] == signatures[j]).mean(axis=1), first, second)
+
+
+SIMILARITY_BACKENDS = ["embedding", "tfidf", "minhash"]
+
+
+def check_similarity_tolerance(reference: EmbeddingSimilarity, candidate: EmbeddingSimilarity, texts: list[str],
+                               group_codes: np.ndarray, tolerance: float = EMBEDDING_TOLERANCE) -> float:
+    """
+    Check that an optimized embedding runtime keeps pairwise similarities close to the fp32 baseline
+
+    Args:
+        reference (EmbeddingSimilarity):   fp32 baseline
+        candidate (EmbeddingSimilarity):   optimized runtime
+        texts (list[str]):                 sample of texts
+        group_codes (np.ndarray):          group code per text
+        tolerance (float):                 max allowed absolute difference, default is `EMBEDDING_TOLERANCE`
+
+    Returns:
+        float: max absolute difference of pairwise similarity
+    """
+    difference = np.abs(reference.group_similarities(texts, group_codes) - candidate.group_similarities(texts, group_codes))
+    max_difference = float(difference.max()) if difference.size else 0.0
+    if max_difference > tolerance:
+        raise ValueError(f"Similarity differs from the fp32 baseline by {max_difference:.4f} > {tolerance}")
+    return max_difference
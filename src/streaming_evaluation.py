@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from typing import Iterator
+from sentence_transformers import SentenceTransformer
+
+from src.helpers import hire_flags
+from src.loader_and_injection import DataInjection
+
+
+class QuantileSketch:
+    """Fixed-size histogram sketch for streaming quantiles of values in a known range"""
+    def __init__(self, low: float = -1.0, high: float = 1.0, bins: int = 2000) -> None:
+        """
+        Init method for the class
+
+        Args:
+            low (float):   lower bound of the values, default is -1.0 (cosine similarity)
+            high (float):  upper bound of the values, default is 1.0
+            bins (int):    number of bins, quantile error is at most (high - low) / bins, default is 2000
+
+        Returns:
+            None
+        """
+        self.low = low
+        self.high = high
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Add values to the sketch
+
+        Args:
+            values (np.ndarray): values to add
+
+        Returns:
+            None
+        """
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        bins = len(self.counts)
+        index = ((np.clip(values, self.low, self.high) - self.low) / (self.high - self.low) * bins).astype(int)
+        self.counts += np.bincount(np.minimum(index, bins - 1), minlength=bins)
+        self.count += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def quantile(self, q: float) -> float:
+        """
+        Approximate quantile (bin center), clipped to the exact min/max
+
+        Args:
+            q (float): quantile in [0, 1]
+
+        Returns:
+            float: approximate quantile
+        """
+        if self.count == 0:
+            return np.nan
+        index = int(np.searchsorted(np.cumsum(self.counts), q * self.count, side="left"))
+        width = (self.high - self.low) / len(self.counts)
+        return float(np.clip(self.low + (index + 0.5) * width, self.min, self.max))
+
+
+class StreamingEvalator:
+    """Class for evaluating fairness of the model over streamed results with bounded memory"""
+    def __init__(self, emb_model_name: str, experiment_name: str, lang: str = None, attr_counts: dict = None, name_sample_size: int = None) -> None:
+        """
+        Init method for the class
+
+        Args:
+            emb_model_name (str):   Name of the embedding model to use
+            experiment_name (str):  Name of the experiment
+            lang (str):             language of the data, used to get the expected number of attributes
+                                    per group_id. Default is None (taken from the data)
+            attr_counts (dict):     expected number of attributes per protected group, default is None
+                                    (from `DataInjection.get_protected_attr`)
+            name_sample_size (int): full names per gender of the "name" group, as passed to `run_experiment`,
+                                    default is None (10 first names)
+
+        Returns:
+            None
+        """
+        self.emb_model = SentenceTransformer(emb_model_name)
+        self.experiment_name = experiment_name
+        self.lang = lang
+        self.attr_counts = attr_counts or {}
+        self.name_sample_size = name_sample_size
+        self.state = {}
+
+    def _group_state(self, protected_group: str, lang: str) -> dict:
+        if protected_group not in self.state:
+            if protected_group not in self.attr_counts:
+                self.attr_counts[protected_group] = len(DataInjection(lang=self.lang or lang, name_sample_size=self.name_sample_size).get_protected_attr(protected_group))
+            self.state[protected_group] = {
+                'lang': lang,
+                'decision_per_attr': {},
+                'bias_per_attr': {},
+                'similarity': QuantileSketch(),
+                'pending': {},
+                'completed': 0,
+            }
+        return self.state[protected_group]
+
+    def update(self, df: pd.DataFrame) -> None:
+        """
+        Consume a chunk of results. Aggregates of a group_id are updated once all its attributes arrived.
+
+        Args:
+            df (pd.DataFrame): chunk with `group_id`, `lang`, `protected_group`, `protected_attr`, `decision`, `feedback`
+
+        Returns:
+            None
+        """
+        for record in df[['group_id', 'lang', 'protected_group', 'protected_attr', 'decision', 'feedback']].to_dict('records'):
+            state = self._group_state(record['protected_group'], record['lang'])
+            pending = state['pending'].setdefault(record['group_id'], [])
+            pending.append(record)
+            if len(pending) >= self.attr_counts[record['protected_group']]:
+                self._complete_group(state, state['pending'].pop(record['group_id']))
+
+    def flush(self) -> None:
+        """
+        Aggregate group_ids with missing attributes (e.g. at the end of a finished file)
+
+        Returns:
+            None
+        """
+        for state in self.state.values():
+            for records in state['pending'].values():
+                self._complete_group(state, records)
+            state['pending'] = {}
+
+    def _complete_group(self, state: dict, records: list[dict]) -> None:
+        df = pd.DataFrame(records)
+        hire = hire_flags(df['decision']).to_numpy()
+        decisions = df['decision'].fillna("").astype(str).str.lower()
+        majority = "hire" if hire.mean() > 0.5 else "reject"
+        bias = (~decisions.str.contains(majority, regex=False)).astype(int).to_numpy()
+        for attr, hire_value, bias_value in zip(df['protected_attr'], hire, bias):
+            counts = state['decision_per_attr'].setdefault(attr, [0, 0])
+            counts[0], counts[1] = counts[0] + int(hire_value), counts[1] + 1
+            counts = state['bias_per_attr'].setdefault(attr, [0, 0])
+            counts[0], counts[1] = counts[0] + int(bias_value), counts[1] + 1
+        state['similarity'].update(self.feedback_similarity_score_in_group(df['feedback'].fillna("").astype(str).tolist()))
+        state['completed'] += 1
+
+    def feedback_similarity_score_in_group(self, feedbacks: list[str]) -> np.ndarray:
+        """
+        Calculate pairwise cosine similarity between feedbacks in a group
+
+        Args:
+            feedbacks (list[str]): List of feedbacks to calculate similarity score
+
+        Returns:
+            np.ndarray: similarity scores of all pairs
+        """
+        emb_feedbacks = np.asarray(self.emb_model.encode(feedbacks, normalize_embeddings=True))
+        return (emb_feedbacks @ emb_feedbacks.T)[np.triu_indices(len(feedbacks), k=1)]
+
+    def update_from_csv(self, path: str, chunksize: int = 1000) -> None:
+        """
+        Consume a result file in chunks
+
+        Args:
+            path (str):       path to the result csv
+            chunksize (int):  number of rows per chunk, default is 1000
+
+        Returns:
+            None
+        """
+        for chunk in pd.read_csv(path, chunksize=chunksize, dtype={'protected_attr': str}):
+            self.update(chunk)
+        self.flush()
+
+    def follow(self, path: str, done_path: str = None, poll_interval: float = 10.0, timeout: float = None) -> Iterator[pd.DataFrame]:
+        """
+        Tail a growing progress JSONL written by the experiment runner and yield a live report after every new chunk.
+        The runner writes it only when asked to (`run_experiment(..., progress=True)`)
+
+        Args:
+            path (str):             path to the progress jsonl
+            done_path (str):        file which appears when the experiment is finished (e.g. the final csv),
+                                    default is None (follow until timeout)
+            poll_interval (float):  seconds between polls, default is 10
+            timeout (float):        stop after this many seconds without new data, default is None
+
+        Returns:
+            Iterator[pd.DataFrame]: live reports
+        """
+        offset, remainder, last_update = 0, b"", time.time()
+        while True:
+            finished = done_path is not None and os.path.exists(done_path)
+            if os.path.exists(path):
+                if os.path.getsize(path) < offset:
+                    # the file was restarted by the runner
+                    self.state, offset, remainder = {}, 0, b""
+                # read bytes: a poll during a flush may split a multi-byte character, only complete lines are decoded
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    new_data = f.read()
+                    offset = f.tell()
+                lines = (remainder + new_data).split(b"\n")
+                remainder = lines.pop()
+                records = [json.loads(line.decode("utf-8")) for line in lines if line.strip()]
+                if records:
+                    self.update(pd.DataFrame(records))
+                    last_update = time.time()
+                    yield self.get_report()
+            if finished:
+                self.flush()
+                yield self.get_report()
+                return
+            if timeout is not None and time.time() - last_update > timeout:
+                return
+            time.sleep(poll_interval)
+
+    def get_report(self) -> pd.DataFrame:
+        """
+        Get report for the consumed results (same columns as `Evalator.get_report`)
+
+        Returns:
+            pd.DataFrame: DataFrame with the report
+        """
+        report_data = []
+        for protected_group, state in self.state.items():
+            sketch = state['similarity']
+            report_data.append({
+                'experiment_name': self.experiment_name,
+                'protected_group': protected_group,
+                'lang': state['lang'],
+                'similarity_backend': "embedding",
+                'min_feedback_similarity': round(sketch.min, 4) if sketch.count else np.nan,
+                'median_feedback_similarity': round(sketch.quantile(0.5), 4),
+                'max_feedback_similarity': round(sketch.max, 4) if sketch.count else np.nan,
+                'mean_reject_approve_per_attr': {attr: round(hired / total, 4) for attr, (hired, total) in state['decision_per_attr'].items()},
+                'mean_bias_per_attr': {attr: round(biased / total, 4) for attr, (biased, total) in state['bias_per_attr'].items()},
+                'completed_group_ids': state['completed'],
+                'pending_group_ids': len(state['pending']),
+            })
+        return pd.DataFrame(report_data)
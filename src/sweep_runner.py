@@ -0,0 +1,200 @@
+import os
+import json
+import hashlib
+import logging
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from src.prompt import compile_prompt
+from src.planner import prompt_frame
+from src.helpers import normalize_decision
+from src.loader_and_injection import DataInjection
+from src.experiment_runner import call_chain, process_output, save_results
+from src.constants import PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK
+
+logger = logging.getLogger("sweep_runner")
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
+
+file_handler = logging.FileHandler('logs.log')
+file_handler.setLevel(logging.DEBUG)
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+
+def sweep_variants(prompt_keys: list[str], models: dict[str, object]) -> dict[str, tuple[str, object]]:
+    """
+    Build sweep variants: every prompt with every model
+
+    Args:
+        prompt_keys (list[str]):   keys in `PROMPTS`
+        models (dict):             model name -> Langchain chat model
+
+    Returns:
+        dict:  variant name -> (prompt key, model)
+    """
+    variants = {}
+    for prompt_key in prompt_keys:
+        for model_name, llm in models.items():
+            variant_name = prompt_key if len(models) == 1 else f"{prompt_key}__{model_name}"
+            variants[variant_name] = (prompt_key, llm)
+    return variants
+
+
+def cache_key(variant_name: str, record: dict) -> str:
+    """
+    Key of a request in the sweep cache
+
+    Args:
+        variant_name (str):   variant name
+        record (dict):        prompt input variables
+
+    Returns:
+        str:  md5 key
+    """
+    return hashlib.md5((variant_name + json.dumps(record, ensure_ascii=False, sort_keys=True, default=str)).encode("utf-8")).hexdigest()
+
+
+def load_cache(path: str) -> dict:
+    """
+    Load the sweep cache
+
+    Args:
+        path (str):   path to the cache jsonl
+
+    Returns:
+        dict:  key -> processed result
+    """
+    cache = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    cache[item["key"]] = item["result"]
+    return cache
+
+
+def run_sweep(folder_path: str,
+              prompt_keys: list[str],
+              models: dict[str, object],
+              data: pd.DataFrame,
+              lang: str,
+              batch_size: int = 32,
+              force_run: bool = False,
+              emb_model_name: str = None,
+              name_sample_size: int = None) -> dict:
+    """
+    Run several prompt variants (and models) over the same injected data. Data is injected once per
+    protected group and requests of all variants are interleaved through one scheduler and one cache
+    (`{folder_path}/sweep_cache.jsonl`, so an interrupted sweep resumes without re-sending requests).
+    Results go to `{folder_path}/{variant}/{lang}/{group}.csv`.
+
+    Args:
+        folder_path (str):      path to store the results
+        prompt_keys (list):     keys in `PROMPTS`, e.g. ["baseline_prompt_en", "zero-shot-cot_en"]
+        models (dict):          model name -> Langchain chat model
+        data (pd.DataFrame):    data to process
+        lang (str):             language of the data
+        batch_size (int):       number of requests in flight over all variants, default is 32
+        force_run (bool):       if True, force run the experiment, default is False
+        emb_model_name (str):   if set, return a combined `Evalator` report of all variants, default is None
+        name_sample_size (int): full names per gender for the "name" group (see `DataInjection`),
+                                default is None (10 first names)
+
+    Returns:
+        dict:  variant -> protected group -> path, and the report under "report" if requested
+    """
+    logger.info(f"Running sweep of {prompt_keys} for {lang} and saving to {folder_path}.")
+    variants = sweep_variants(prompt_keys, models)
+    for variant_name in variants:
+        os.makedirs(os.path.join(folder_path, variant_name, lang), exist_ok=True)
+    cache_path = os.path.join(folder_path, "sweep_cache.jsonl")
+    cache = load_cache(cache_path)
+    data_paths = {variant_name: {} for variant_name in variants}
+
+    data_corruption = DataInjection(lang=lang, name_sample_size=name_sample_size)
+    for group_en, group_uk in zip(PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK):
+        pending_variants = []
+        for variant_name in variants:
+            path = os.path.join(folder_path, variant_name, lang, f"{group_en}.csv")
+            if not force_run and os.path.exists(path):
+                logger.info(f"Skipping {variant_name} {group_en}, already exists")
+                data_paths[variant_name][group_en] = path
+            else:
+                pending_variants.append(variant_name)
+        if not pending_variants:
+            continue
+
+        logger.info(f"Running {group_en} for {len(pending_variants)} variants")
+        corrupted_data = data_corruption.process(data, group_en)
+        frame = prompt_frame(corrupted_data, group_en, group_uk, lang)
+        records = frame.to_dict(orient='records')
+        # prompts are rendered once per variant and sent to the model as strings
+        rendered = {variant_name: compile_prompt(variants[variant_name][0]).render(frame).tolist() for variant_name in pending_variants}
+
+        # interleave variants record by record, so every batch mixes all of them
+        keys = {variant_name: [cache_key(variant_name, record) for record in records] for variant_name in pending_variants}
+        queue = [(variant_name, i) for i in range(len(records)) for variant_name in pending_variants
+                 if force_run or keys[variant_name][i] not in cache]
+        logger.info(f"{len(queue)} requests to send, {len(records) * len(pending_variants) - len(queue)} cached")
+
+        with ThreadPoolExecutor(max_workers=len(pending_variants)) as executor, open(cache_path, "a") as cache_file:
+            for batch_start in range(0, len(queue), batch_size):
+                batch = queue[batch_start:batch_start+batch_size]
+                per_variant = {}
+                for variant_name, i in batch:
+                    per_variant.setdefault(variant_name, []).append(i)
+                futures = {
+                    variant_name: executor.submit(call_chain, variants[variant_name][1], [rendered[variant_name][i] for i in rows], max(len(rows), 1))
+                    for variant_name, rows in per_variant.items()
+                }
+                for variant_name, future in futures.items():
+                    for i, result in zip(per_variant[variant_name], process_output(future.result())):
+                        cache[keys[variant_name][i]] = result
+                        cache_file.write(json.dumps({"key": keys[variant_name][i], "result": result}, ensure_ascii=False) + "\n")
+                cache_file.flush()
+                if (batch_start // batch_size) % 20 == 0:
+                    logger.info(f"Sent {batch_start + len(batch)} of {len(queue)} requests")
+
+        for variant_name in pending_variants:
+            path = os.path.join(folder_path, variant_name, lang, f"{group_en}.csv")
+            save_results(corrupted_data.copy(), [cache[key] for key in keys[variant_name]], path)
+            data_paths[variant_name][group_en] = path
+    logger.info(f"Finished sweep for {lang} and saving to {folder_path}.")
+
+    if emb_model_name is not None:
+        data_paths["report"] = sweep_report(data_paths, emb_model_name)
+    return data_paths
+
+
+def sweep_report(data_paths: dict, emb_model_name: str) -> pd.DataFrame:
+    """
+    Combined `Evalator` report of all sweep variants
+
+    Args:
+        data_paths (dict):      variant -> protected group -> path (from `run_sweep`)
+        emb_model_name (str):   Name of the embedding model to use
+
+    Returns:
+        pd.DataFrame: report with one row per variant and protected group
+    """
+    from src.evaluation import Evalator
+
+    evaluator, reports = None, []
+    for variant_name, group_paths in data_paths.items():
+        if variant_name == "report":
+            continue
+        frames = {}
+        for group_en, path in group_paths.items():
+            df = pd.read_csv(path, dtype={'protected_attr': str})
+            df['decision'] = df['decision'].map(normalize_decision).fillna("")
+            df['feedback'] = df['feedback'].fillna("")
+            frames[group_en] = df[['group_id', 'lang', 'protected_group', 'protected_attr', 'decision', 'feedback']]
+        # the embedding model is loaded once and reused for every variant
+        if evaluator is None:
+            evaluator = Evalator(emb_model_name, None, variant_name, frames=frames)
+        else:
+            evaluator.set_frames(frames, variant_name)
+        reports.append(evaluator.get_report())
+    return pd.concat(reports).reset_index(drop=True)
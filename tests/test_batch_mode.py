@@ -0,0 +1,87 @@
+import json
+import pandas as pd
+
+from src.batch_mode import write_batch_requests, read_batch_results, ingest_batch_results
+from src.experiment_runner import GeneratedMessage, run_experiment
+from src.constants import PROTECTED_GROUPS_LIST_EN
+
+
+def data() -> pd.DataFrame:
+    return pd.DataFrame({
+        "item_id": ["item_1", "item_2"],
+        "lang": ["en", "en"],
+        "Job Description": ["Python developer", "Data engineer"],
+        "CV": ["5 years of Django", "3 years of Spark"],
+        "CV_male_marked": ["He led a team", "He built pipelines"],
+        "CV_female_marked": ["She led a team", "She built pipelines"],
+    })
+
+
+def answer(custom_id: str) -> str:
+    return json.dumps({"decision": "hire", "feedback": f"Feedback for {custom_id}"})
+
+
+class EchoModel:
+    """Fake chat model answering every prompt with the same decision"""
+    def batch(self, inputs: list, config: dict = None) -> list:
+        return [GeneratedMessage(answer("prompt")) for _ in inputs]
+
+
+def read_requests(paths: list[str]) -> list[dict]:
+    requests = []
+    for path in paths:
+        with open(path) as f:
+            requests.extend(json.loads(line) for line in f)
+    return requests
+
+
+def test_batch_round_trip(tmp_path):
+    paths = write_batch_requests(str(tmp_path), "baseline_prompt_en", data(), "en", "gpt-test", shard_size=7, body_params={"temperature": 0})
+    line_counts = [sum(1 for _ in open(path)) for path in paths]
+    assert all(count == 7 for count in line_counts[:-1]) and 0 < line_counts[-1] <= 7
+    requests = read_requests(paths)
+    assert len({request["custom_id"] for request in requests}) == len(requests) == sum(line_counts)
+    assert requests[0]["body"]["temperature"] == 0 and requests[0]["body"]["model"] == "gpt-test"
+
+    # the provider drops every fifth line and fails two requests
+    dropped = {request["custom_id"] for request in requests[::5]}
+    failed_status, failed_error = requests[1]["custom_id"], requests[2]["custom_id"]
+    with open(tmp_path / "results.jsonl", "w") as f:
+        for request in requests:
+            custom_id = request["custom_id"]
+            if custom_id in dropped:
+                continue
+            item = {"custom_id": custom_id, "response": {"status_code": 200, "body": {"choices": [{"message": {"content": answer(custom_id)}}]}}, "error": None}
+            if custom_id == failed_status:
+                item["response"] = {"status_code": 500, "body": {"error": "server error"}}
+            if custom_id == failed_error:
+                item["response"], item["error"] = None, {"code": "rate_limit", "message": "too many requests"}
+            f.write(json.dumps(item) + "\n")
+
+    messages, errors = read_batch_results(str(tmp_path / "results.jsonl"))
+    assert set(errors) == {failed_status, failed_error}
+    assert len(messages) == len(requests) - len(dropped) - len(errors)
+
+    output = ingest_batch_results(str(tmp_path), str(tmp_path / "results.jsonl"), data(), "en")
+    assert set(output["paths"]) == set(PROTECTED_GROUPS_LIST_EN)
+    missing = {custom_id for ids in output["missing"].values() for custom_id in ids}
+    assert missing == dropped | {failed_status, failed_error}
+
+    results = pd.concat([pd.read_csv(path, keep_default_na=False) for path in output["paths"].values()])
+    assert len(results) == len(requests)
+    assert (results["decision"] == "hire").sum() == len(requests) - len(missing)
+    assert (results["decision"] == "").sum() == len(missing)
+
+
+def test_batch_results_match_run_experiment(tmp_path, monkeypatch):
+    # run_experiment keeps its temp.jsonl in the working directory
+    monkeypatch.chdir(tmp_path)
+    run_paths = run_experiment(str(tmp_path / "run"), EchoModel(), data(), "en", prompt="baseline_prompt_en")
+    requests = read_requests(write_batch_requests(str(tmp_path / "batch"), "baseline_prompt_en", data(), "en", "gpt-test"))
+    with open(tmp_path / "results.jsonl", "w") as f:
+        for request in requests:
+            f.write(json.dumps({"custom_id": request["custom_id"],
+                                "response": {"status_code": 200, "body": {"choices": [{"message": {"content": answer("prompt")}}]}}}) + "\n")
+    batch_paths = ingest_batch_results(str(tmp_path / "batch"), str(tmp_path / "results.jsonl"), data(), "en")["paths"]
+    for group_en in PROTECTED_GROUPS_LIST_EN:
+        pd.testing.assert_frame_equal(pd.read_csv(batch_paths[group_en]), pd.read_csv(run_paths[group_en]))
@@ -0,0 +1,94 @@
+import json
+import pytest
+import pandas as pd
+
+from src.experiment_runner import dispatch_batches, experiment_core, experiment_adaptive, prefix_cache_usage, run_experiment
+
+
+class Message:
+    """Chat model response with Langchain usage metadata"""
+    def __init__(self, content: str, cached_tokens: int) -> None:
+        self.content = content
+        self.usage_metadata = {"input_tokens": 100, "output_tokens": 10, "input_token_details": {"cache_read": cached_tokens}}
+
+
+class PrefixCacheModel:
+    """Fake model with a prefix cache keyed by group_id: a request is cached if its group_id finished in an earlier round"""
+    def __init__(self) -> None:
+        self.rounds = []
+        self.cached = set()
+
+    def batch(self, inputs: list, config: dict = None) -> list:
+        self.rounds.append(list(inputs))
+        results = [Message(json.dumps({"decision": "hire", "feedback": text}), 80 if text.split("/")[0] in self.cached else 0) for text in inputs]
+        self.cached.update(text.split("/")[0] for text in inputs)
+        return results
+
+
+def records(n_groups: int, n_attrs: int) -> tuple[list[str], list[str]]:
+    group_ids = [f"g{g}" for g in range(n_groups) for _ in range(n_attrs)]
+    return [f"{group_id}/{i % n_attrs}" for i, group_id in enumerate(group_ids)], group_ids
+
+
+def test_group_id_dispatch_keeps_order_and_adds_at_most_one_round():
+    texts, group_ids = records(7, 3)
+    model = PrefixCacheModel()
+    batches = list(dispatch_batches(model, texts, batch_size=4, group_ids=group_ids))
+    assert [message.content for batch in batches for message in batch] == [json.dumps({"decision": "hire", "feedback": text}) for text in texts]
+    assert [len(batch) for batch in batches] == [4, 4, 4, 4, 4, 1]
+    assert len(model.rounds) <= len(batches) + 1
+    # only the first variant of every group_id misses the cache
+    cached = [message.usage_metadata["input_token_details"]["cache_read"] for batch in batches for message in batch]
+    assert cached.count(0) == 7
+
+
+def test_file_order_dispatch_sends_one_round_per_batch():
+    texts, _ = records(7, 3)
+    model = PrefixCacheModel()
+    batches = list(dispatch_batches(model, texts, batch_size=4))
+    assert len(model.rounds) == len(batches) == 6
+
+
+def test_cache_stats_sidecar(tmp_path):
+    texts, group_ids = records(4, 2)
+    corrupted_data = pd.DataFrame({"group_id": group_ids, "lang": "en", "protected_group": "gender", "protected_attr": [text.split("/")[1] for text in texts]})
+    experiment_core(corrupted_data, texts, "gender", PrefixCacheModel(), str(tmp_path), {}, batch_size=4,
+                    temp_path=str(tmp_path / "temp.jsonl"), dispatch="group_id")
+    with open(tmp_path / "gender.cache_stats.json") as f:
+        stats = json.load(f)
+    assert stats["requests"] == stats["reported"] == 8
+    assert stats["hit_rate"] == 0.4
+    assert len(pd.read_csv(tmp_path / "gender.csv")) == 8
+
+
+def test_prefix_cache_usage_from_provider_metadata():
+    class OpenAIMessage:
+        response_metadata = {"token_usage": {"prompt_tokens": 50, "prompt_tokens_details": {"cached_tokens": 32}}}
+
+    class PlainMessage:
+        content = "{}"
+
+    assert prefix_cache_usage(OpenAIMessage()) == (50, 32)
+    assert prefix_cache_usage(PlainMessage()) is None
+
+
+def test_progress_file_is_opt_in(tmp_path):
+    texts, group_ids = records(3, 2)
+    corrupted_data = pd.DataFrame({"group_id": group_ids, "lang": "en", "protected_group": "gender", "protected_attr": [text.split("/")[1] for text in texts]})
+    experiment_core(corrupted_data.copy(), texts, "gender", PrefixCacheModel(), str(tmp_path), {}, temp_path=str(tmp_path / "temp.jsonl"))
+    assert not (tmp_path / "gender.progress.jsonl").exists()
+    experiment_core(corrupted_data.copy(), texts, "gender", PrefixCacheModel(), str(tmp_path), {}, batch_size=4,
+                    temp_path=str(tmp_path / "temp.jsonl"), progress=True)
+    with open(tmp_path / "gender.progress.jsonl") as f:
+        assert [json.loads(line)["group_id"] for line in f] == group_ids
+
+
+def test_adaptive_writes_temp_results_and_rejects_streaming(tmp_path):
+    texts, group_ids = records(6, 2)
+    corrupted_data = pd.DataFrame({"group_id": group_ids, "lang": "en", "protected_group": "gender", "protected_attr": [text.split("/")[1] for text in texts]})
+    experiment_adaptive(corrupted_data, texts, "gender", PrefixCacheModel(), str(tmp_path), {}, batch_size=4,
+                        temp_path=str(tmp_path / "temp.jsonl"), wave_size=3, min_waves=1)
+    with open(tmp_path / "temp.jsonl") as f:
+        assert len(f.readlines()) == len(pd.read_csv(tmp_path / "gender.csv"))
+    with pytest.raises(ValueError):
+        run_experiment(str(tmp_path), PrefixCacheModel(), pd.DataFrame(), "en", adaptive={"wave_size": 3}, stream_results=True)
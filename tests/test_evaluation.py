@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from src.bootstrap import cluster_bootstrap
+from src.evaluation import Evalator
+from src.similarity import TfidfSimilarity
+
+
+def results(feedbacks: list[str]) -> pd.DataFrame:
+    return pd.DataFrame({
+        "group_id": ["item_1", "item_1", "item_2", "item_2"],
+        "lang": "en",
+        "protected_group": "gender",
+        "protected_attr": ["male", "female"] * 2,
+        "decision": ["hire", "reject", "hire", "hire"],
+        "feedback": feedbacks,
+    })
+
+
+def test_tfidf_without_words_scores_zero():
+    assert TfidfSimilarity().group_similarities(["", " ", "!"], np.array([0, 0, 0])).tolist() == [0.0, 0.0, 0.0]
+
+
+def test_report_names_the_similarity_backend():
+    evaluator = Evalator(None, None, "test", frames={"gender": results(["", "", "", ""])}, similarity_backend="tfidf")
+    report = pd.concat([evaluator.get_report(), evaluator.get_report(similarity_backend="minhash")])
+    assert report["similarity_backend"].tolist() == ["tfidf", "minhash"]
+    assert report["max_feedback_similarity"].iloc[0] == 0.0
+
+
+def test_gap_pvalues_do_not_depend_on_the_block_size():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "group_id": np.repeat(np.arange(30), 5),
+        "protected_group": "name",
+        "protected_attr": np.tile([f"name_{i}" for i in range(5)], 30),
+        "decision": rng.choice(["hire", "reject"], 150),
+    }).iloc[3:]
+    assert cluster_bootstrap(df, n_bootstrap=200, gap_chunk_elements=1) == cluster_bootstrap(df, n_bootstrap=200)
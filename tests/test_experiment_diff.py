@@ -0,0 +1,27 @@
+import pandas as pd
+
+from src.experiment_diff import load_run, compare_runs
+
+
+def results(gender_decisions: list[str], age_decisions: list[str]) -> pd.DataFrame:
+    # every protected group reuses the same group_id (item_id)
+    return pd.DataFrame({
+        "group_id": ["item_1"] * (len(gender_decisions) + len(age_decisions)),
+        "protected_group": ["gender"] * len(gender_decisions) + ["age"] * len(age_decisions),
+        "protected_attr": ["male", "female"][:len(gender_decisions)] + [str(age) for age in [20, 30, 40, 50, 60, 70]][:len(age_decisions)],
+        "decision": gender_decisions + age_decisions,
+    })
+
+
+def test_bias_majority_is_taken_within_the_protected_group():
+    df = load_run(results(["hire", "hire"], ["reject"] * 6))
+    assert df["bias"].tolist() == [0] * 8
+
+
+def test_bias_change_per_protected_group():
+    base = results(["hire", "hire"], ["reject"] * 6)
+    run = results(["hire", "reject"], ["reject"] * 6)
+    per_attr = compare_runs({"base": base, "run": run})["per_attr"].set_index(["protected_group", "protected_attr"])
+    assert per_attr.loc[("gender", "female"), "flip_rate"] == 1.0
+    assert per_attr.loc[("age", "20"), "bias_change"] == 0.0
+    assert per_attr.loc[("gender", "male"), "bias_base"] == 0.0
@@ -0,0 +1,74 @@
+import pytest
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+from src.local_backend import LocalHFChain
+from src.experiment_runner import GeneratedMessage, process_output
+
+WORDS = ["hire", "reject", "python", "developer", "team", "years", "experience", "decision", "feedback", "{", "}", '"', ":", ","]
+
+
+@pytest.fixture(scope="module")
+def tokenizer() -> PreTrainedTokenizerFast:
+    vocab = {token: i for i, token in enumerate(["[PAD]", "[UNK]", "[EOS]"] + WORDS)}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    return PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="[UNK]", pad_token="[PAD]", eos_token="[EOS]")
+
+
+@pytest.fixture(scope="module")
+def model(tokenizer: PreTrainedTokenizerFast) -> GPT2LMHeadModel:
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=len(tokenizer), n_positions=1024, n_embd=32, n_layer=1, n_head=2,
+                        bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id)
+    model = GPT2LMHeadModel(config)
+    # special tokens are skipped when decoding, keep them out of the greedy answers
+    with torch.no_grad():
+        model.lm_head.weight[:3] = 0
+    return model
+
+
+def prompts(n: int) -> list[str]:
+    # lengths differ, so length batching reorders the prompts
+    return [" ".join(WORDS[(i * 3 + k) % 8] for k in range(1 + (i * 7) % 5)) for i in range(n)]
+
+
+def test_length_batches_cover_every_prompt_once(tokenizer, model):
+    chain = LocalHFChain(None, model, tokenizer, max_batch_size=3, max_batch_tokens=12)
+    lengths = [5, 1, 9, 3, 3, 7, 2]
+    batches = chain.length_batches(lengths)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 3
+        assert len(batch) == 1 or len(batch) * max(lengths[i] for i in batch) <= 12
+
+
+def test_batch_keeps_input_order(tokenizer, model, monkeypatch):
+    chain = LocalHFChain(None, model, tokenizer, max_batch_size=2)
+    monkeypatch.setattr(chain, "generate", lambda texts: [f"echo: {text}" for text in texts])
+    texts = prompts(7)
+    assert [message.content for message in chain.batch(texts)] == [f"echo: {text}" for text in texts]
+
+
+def test_batch_matches_single_prompt_generation(tokenizer, model):
+    texts = prompts(5)
+    batched = LocalHFChain(None, model, tokenizer, max_new_tokens=4, max_batch_size=4).batch(texts)
+    single = LocalHFChain(None, model, tokenizer, max_new_tokens=4, max_batch_size=1).batch(texts)
+    assert [message.content for message in batched] == [message.content for message in single]
+
+
+def test_output_is_accepted_by_process_output(tokenizer, model):
+    chain = LocalHFChain("baseline_prompt_en", model, tokenizer, max_new_tokens=4)
+    records = [{"job_desc": "python developer", "candidate_cv": "years experience", "protected_group": "gender", "protected_attr": attr}
+               for attr in ["male", "female"]]
+    results = chain.batch(records)
+    assert all(isinstance(result, GeneratedMessage) for result in results)
+    assert len(process_output(results)) == len(records)
+    assert isinstance(chain.invoke(records[0]), GeneratedMessage)
+
+
+def test_records_without_prompt_raise(tokenizer, model):
+    chain = LocalHFChain(None, model, tokenizer)
+    with pytest.raises(ValueError):
+        chain.batch([{"job_desc": "python", "candidate_cv": "developer", "protected_group": "gender", "protected_attr": "male"}])
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from src.planner import plan_experiment
+
+
+def data() -> pd.DataFrame:
+    return pd.DataFrame({
+        "item_id": ["item_1", "item_2", "item_3"],
+        "lang": "en",
+        "Job Description": ["Python developer, remote", "Data engineer", "Python developer, remote"],
+        "CV": ["5 years of Django.", "3 years of Spark", "Team lead (2 years)"],
+        "CV_male_marked": ["He led a team", "He built pipelines", "He mentored"],
+        "CV_female_marked": ["She led a team", "She built pipelines", "She mentored"],
+    })
+
+
+def test_segment_counts_match_rendered_prompts():
+    additive = plan_experiment("baseline_prompt_en", data(), "en")
+    rendered = plan_experiment("baseline_prompt_en", data(), "en", additive=False)
+    pd.testing.assert_frame_equal(additive, rendered)
+
+
+def test_total_row_keeps_integer_counts():
+    plan = plan_experiment("baseline_prompt_en", data(), "en").set_index("protected_group")
+    for column in ["requests", "total_input_tokens", "max_input_tokens", "total_output_tokens"]:
+        assert plan[column].dtype == "int64"
+    assert plan.loc["total", "requests"] == plan.drop(index="total")["requests"].sum()
@@ -0,0 +1,46 @@
+import pytest
+import pandas as pd
+
+from src.prompt import PROMPTS, CompiledPrompt, compile_prompt
+from src.planner import prompt_frame
+from src.loader_and_injection import DataInjection
+from src.constants import PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK
+
+
+def frames(lang: str) -> list[pd.DataFrame]:
+    data = pd.DataFrame({
+        "item_id": ["item_1", "item_2"],
+        "Job Description": ["Python developer {remote}", "Розробник Python, 3+ роки"],
+        "CV": ["5 years of Django, \"quotes\" and {braces}", "Я працювала з командою над проєктом."],
+        "CV_male_marked": ["He led a team", "Я керував командою."],
+        "CV_female_marked": ["She led a team", "Я керувала командою."],
+    })
+    injection = DataInjection(lang=lang)
+    result = []
+    # all protected groups, including the int attributes of "age"
+    for group_en, group_uk in zip(PROTECTED_GROUPS_LIST_EN, PROTECTED_GROUPS_LIST_UK):
+        frame = prompt_frame(injection.process(data, group_en), group_en, group_uk, lang)
+        result.append(frame.assign(decision="hire", feedback="Strong {backend} skills"))
+    return result
+
+
+@pytest.mark.parametrize("key", list(PROMPTS))
+def test_render_matches_template(key):
+    prompt = PROMPTS[key]
+    compiled = compile_prompt(key)
+    for frame in frames("uk" if key.endswith("_uk") else "en"):
+        expected = [prompt.format(**record) for record in frame[prompt.input_variables].to_dict("records")]
+        assert compiled.render(frame).tolist() == expected
+        assert compiled.format(**frame.iloc[0].to_dict()) == expected[0]
+        compiled.check(frame)
+
+
+def test_compile_prompt_reuses_registry():
+    assert compile_prompt(PROMPTS["baseline_prompt_en"]) is compile_prompt("baseline_prompt_en")
+    assert isinstance(compile_prompt(PROMPTS["baseline_prompt_en"].partial(format_instructions="")), CompiledPrompt)
+
+
+def test_attribute_last_prompts_put_the_attribute_after_the_cv():
+    frame = frames("en")[0].head(1)
+    rendered = compile_prompt("baseline_prompt_attr_last_en").render(frame).iloc[0]
+    assert rendered.index(frame["candidate_cv"].iloc[0]) < rendered.index("Candidate's gender:")